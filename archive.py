@@ -0,0 +1,86 @@
+"""Архив проданных карточек и освобождение места в файле БД.
+
+Бот сам переносит старые проданные карточки в user_cards_archive (задача
+archive_sold_cards); здесь - то же вручную и перевод существующей БД в
+режим auto_vacuum = INCREMENTAL. Перевод выполняет полный VACUUM: он
+переписывает весь файл и блокирует запись, поэтому бот на это время
+нужно остановить.
+
+Пример:
+    python archive.py status
+    python archive.py run --days 7
+    python archive.py vacuum --db bot_database.db
+"""
+import sys
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from config import Config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+AUTO_VACUUM_MODES = {0: 'NONE', 1: 'FULL', 2: 'INCREMENTAL'}
+
+
+def status(database):
+    """(проданных в user_cards, в архиве, свободных страниц, всего страниц, режим auto_vacuum)"""
+    with database.get_connection() as conn:
+        sold = conn.execute('SELECT COUNT(*) FROM user_cards WHERE is_sold = 1').fetchone()[0]
+        archived = conn.execute('SELECT COUNT(*) FROM user_cards_archive').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    return sold, archived, free, pages, AUTO_VACUUM_MODES.get(mode, mode)
+
+
+def run(database, days, batch_size, pages):
+    """Перенести в архив всё, что старше days дней; вернуть число карточек"""
+    sold_before = datetime.now() - timedelta(days=days)
+    moved = 0
+    while True:
+        batch = database.archive_sold_cards(sold_before, batch_size)
+        moved += batch
+        if batch < batch_size:
+            break
+    while database.incremental_vacuum(pages):
+        pass
+    return moved
+
+
+def convert(database):
+    """Включить auto_vacuum = INCREMENTAL и пересобрать файл"""
+    with database.get_connection() as conn:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Архив проданных карточек")
+    parser.add_argument('command', choices=('status', 'run', 'vacuum'))
+    parser.add_argument('--db', default=Config.DB_PATH, help="файл базы данных")
+    parser.add_argument('--days', type=int, default=Config.ARCHIVE_AFTER_DAYS,
+                        help="архивировать карточки, проданные раньше стольких дней назад")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    database = Database(args.db, pool_size=1)
+    try:
+        if args.command == 'run':
+            moved = run(database, args.days, Config.ARCHIVE_BATCH_SIZE, Config.VACUUM_STEP_PAGES)
+            print(f"Перенесено в архив: {moved}")
+        elif args.command == 'vacuum':
+            convert(database)
+            print("auto_vacuum = INCREMENTAL, файл пересобран")
+
+        sold, archived, free, pages, mode = status(database)
+        print(f"Проданных в user_cards: {sold}, в архиве: {archived}")
+        print(f"Страниц: {pages}, свободных: {free}, auto_vacuum: {mode}")
+        return 0
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
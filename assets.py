@@ -0,0 +1,200 @@
+"""Подготовка изображений карточек к отправке в Telegram.
+
+Каждая картинка из data/<редкость>/ уменьшается до ASSET_MAX_SIDE по
+большей стороне и пересохраняется в JPEG (или WebP) с ограниченным
+качеством. Результаты лежат в папке кэша под именем по SHA-256 исходного
+файла, поэтому повторный запуск обрабатывает только новые и изменённые
+картинки, а одинаковые файлы в разных папках обрабатываются один раз.
+
+Без Pillow обработка отключается и отправляются исходные файлы.
+
+Запуск как шаг сборки:
+    python assets.py
+"""
+import os
+import sys
+import json
+import shutil
+import logging
+import threading
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from photo_cache import PhotoCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+# Ограничение Telegram на соотношение сторон фото
+MAX_ASPECT_RATIO = 20
+
+
+def _convert(source, target, max_side, quality, image_format):
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((max_side, max_side))
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            # У JPEG нет прозрачности - кладём картинку на белый фон
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        width, height = image.size
+        if max(width, height) > MAX_ASPECT_RATIO * min(width, height):
+            logger.warning(f"{source}: соотношение сторон больше {MAX_ASPECT_RATIO}:1")
+
+        tmp = f'{target}.{os.getpid()}.tmp'
+        image.save(tmp, image_format, quality=quality, optimize=True)
+        source_format = original.format
+        source_fits = max(original.size) <= max_side
+
+    # Уже подходящий исходный файл меньше результата - оставляем его как есть
+    if (source_format == image_format and source_fits
+            and os.path.getsize(source) <= os.path.getsize(tmp)):
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, target)
+
+
+def build_asset(source, target_dir, max_side, quality, image_format):
+    """Обработать один файл (выполняется в процессе пула); вернуть хэш исходника"""
+    content_hash = PhotoCache.file_hash(source)
+    target = os.path.join(target_dir, content_hash + EXTENSIONS[image_format])
+    if not os.path.exists(target):
+        _convert(source, target, max_side, quality, image_format)
+    return content_hash
+
+
+class AssetPipeline:
+    """Кэш обработанных изображений карточек с адресацией по содержимому"""
+
+    def __init__(self, cache_dir, max_side=1280, quality=85, image_format='JPEG', workers=None):
+        self.image_format = image_format.upper()
+        if self.image_format not in EXTENSIONS:
+            raise ValueError(f"Неподдерживаемый формат изображений: {image_format}")
+        self.max_side = max_side
+        self.quality = quality
+        self.workers = workers
+        self.cache_dir = cache_dir
+        # Свои файлы для каждого набора настроек: смена качества не смешивает результаты
+        self.target_dir = os.path.join(
+            cache_dir, f'{self.image_format.lower()}-{max_side}-q{quality}'
+        )
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        # исходный путь -> обработанный файл
+        self._assets = {}
+        self._build_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def _asset_path(self, content_hash):
+        return os.path.join(self.target_dir, content_hash + EXTENSIONS[self.image_format])
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Манифест изображений повреждён и будет пересобран: {e}")
+            return {}
+
+    def _save_manifest(self, manifest):
+        # Имя с pid: манифест могут одновременно писать несколько процессов бота
+        tmp = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def build(self, paths):
+        """Обработать новые и изменённые файлы; вернуть число обработанных"""
+        if not self.enabled:
+            logger.warning("Pillow не установлен - изображения отправляются без обработки")
+            return 0
+
+        with self._build_lock:
+            os.makedirs(self.target_dir, exist_ok=True)
+            manifest = self._load_manifest()
+            # путь -> {'mtime_ns', 'size', 'hash'}
+            updated = {}
+            pending = []
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    logger.error(f"Ошибка при чтении изображения {path}: {e}")
+                    continue
+                entry = manifest.get(path)
+                if (entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size
+                        and os.path.exists(self._asset_path(entry['hash']))):
+                    updated[path] = entry
+                else:
+                    pending.append((path, stat))
+
+            if pending:
+                logger.info(f"Обработка изображений карточек: {len(pending)} шт.")
+                # build() вызывается и из фонового потока бота: fork процесса с
+                # потоками может унаследовать занятые блокировки, поэтому spawn
+                with ProcessPoolExecutor(max_workers=self.workers,
+                                         mp_context=multiprocessing.get_context('spawn')) as pool:
+                    futures = [
+                        (path, stat, pool.submit(build_asset, path, self.target_dir,
+                                                 self.max_side, self.quality, self.image_format))
+                        for path, stat in pending
+                    ]
+                    for path, stat, future in futures:
+                        try:
+                            content_hash = future.result()
+                        except Exception as e:
+                            logger.error(f"Не удалось обработать изображение {path}: {e}")
+                            continue
+                        updated[path] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                                         'hash': content_hash}
+
+            self._report_duplicates(updated)
+            # Записи об удалённых файлах не переносятся в новый манифест
+            self._save_manifest(updated)
+            self._assets = {path: self._asset_path(entry['hash']) for path, entry in updated.items()}
+            return len(pending)
+
+    @staticmethod
+    def _report_duplicates(entries):
+        by_hash = defaultdict(list)
+        for path, entry in entries.items():
+            by_hash[entry['hash']].append(path)
+        for paths in by_hash.values():
+            if len(paths) > 1:
+                logger.warning(f"Одинаковые изображения карточек: {', '.join(sorted(paths))}")
+
+    def resolve(self, path):
+        """Файл для отправки: обработанный, если он готов, иначе исходный"""
+        return self._assets.get(path, path)
+
+
+def main(argv=None):
+    from config import Config
+    from catalog import CardCatalog
+
+    logging.basicConfig(format='%(levelname)s - %(message)s', level=logging.INFO)
+    catalog = CardCatalog(Config.CARDS_PATH, Config.DROP_RATES, extensions=Config.CARD_EXTENSIONS)
+    pipeline = AssetPipeline(Config.ASSETS_CACHE_PATH, max_side=Config.ASSET_MAX_SIDE,
+                             quality=Config.ASSET_QUALITY, image_format=Config.ASSET_FORMAT,
+                             workers=Config.ASSET_WORKERS)
+    paths = [card.path for cards in catalog.snapshot.cards.values() for card in cards]
+    processed = pipeline.build(paths)
+    print(f"Изображений: {len(paths)}, обработано заново: {processed}")
+    return 0 if pipeline.enabled else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
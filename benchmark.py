@@ -0,0 +1,353 @@
+"""Нагрузочный тест CardBot без обращения к настоящему Bot API.
+
+Обновления (команды и нажатия кнопок) собираются как настоящие Update и
+проходят через обработчики CardBot. Запросы к Telegram перехватывает
+StubRequest: он записывает вызовы, отвечает правдоподобными данными и
+имитирует сетевую задержку. База создаётся во временной папке по
+актуальной схеме и заполняется синтетическими пользователями.
+
+Пример:
+    python benchmark.py --users 10000 --cards 200 --updates 2000 --latency 0.05
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import itertools
+import threading
+from collections import Counter
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from config import Config
+from catalog import CardCatalog
+from database import Database
+from main import CardBot
+
+logger = logging.getLogger(__name__)
+
+
+class StubRequest(BaseRequest):
+    """Заглушка HTTP-клиента Bot API: считает вызовы и имитирует задержку"""
+
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self._message_ids = itertools.count(1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params, **extra):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+        }
+        message.update(extra)
+        return message
+
+    def _photo(self, params):
+        message_id = next(self._message_ids)
+        return self._message(params, message_id=message_id, photo=[{
+            'file_id': f'stub-photo-{message_id}',
+            'file_unique_id': f'stub-{message_id}',
+            'width': 800,
+            'height': 800,
+        }])
+
+    def _result(self, endpoint, params):
+        if endpoint == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'CardBot', 'username': 'card_bot'}
+        if endpoint == 'getChatMember':
+            return {'status': 'member',
+                    'user': {'id': params['user_id'], 'is_bot': False, 'first_name': 'User'}}
+        if endpoint == 'getChat':
+            return {'id': params['chat_id'], 'type': 'channel', 'username': 'channel'}
+        if endpoint == 'sendPhoto':
+            return self._photo(params)
+        if endpoint == 'sendMediaGroup':
+            media = params['media']
+            if isinstance(media, str):
+                media = json.loads(media)
+            return [self._photo(params) for _ in media]
+        if endpoint in ('sendMessage', 'editMessageText', 'editMessageCaption'):
+            return self._message(params, text=params.get('text', ''))
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+        payload = {'ok': True, 'result': self._result(endpoint, params)}
+        return 200, json.dumps(payload).encode('utf-8')
+
+
+class QueryCounter:
+    """Считает выполнения SQL-выражений на всех соединениях пула.
+
+    sqlite3 сообщает о каждом срабатывании триггера текстом внешнего
+    выражения (с подставленными параметрами), поэтому подряд идущие
+    одинаковые строки на одном соединении - одно выполнение. Строки
+    executemany различаются параметрами и считаются каждая.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def on_connect(self, conn):
+        last = [None]
+
+        def trace(statement):
+            if statement == last[0]:
+                return
+            last[0] = statement
+            with self._lock:
+                self.count += 1
+
+        conn.set_trace_callback(trace)
+
+
+def seed_database(database, catalog, users, cards_per_user, rng):
+    """Заполнить БД пользователями и карточками"""
+    all_cards = [card for cards in catalog.snapshot.cards.values() for card in cards]
+    card_ids = [database.get_card_id(card.name, card.rarity, card.path) for card in all_cards]
+
+    with database.transaction() as conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, username) VALUES (?, ?)',
+            ((user_id, f'user{user_id}') for user_id in range(1, users + 1))
+        )
+        # Балансы - через журнал, как в работающем боте
+        conn.executemany(
+            "INSERT INTO balance_ledger (user_id, amount, reason) VALUES (?, ?, 'grant')",
+            ((user_id, rng.randrange(0, 5000)) for user_id in range(1, users + 1))
+        )
+        rows = (
+            (user_id, rng.choice(card_ids), int(rng.random() < 0.2))
+            for user_id in range(1, users + 1)
+            for _ in range(rng.randint(0, cards_per_user * 2))
+        )
+        while True:
+            batch = list(itertools.islice(rows, 50000))
+            if not batch:
+                break
+            conn.executemany(
+                'INSERT INTO user_cards (user_id, card_id, is_sold) VALUES (?, ?, ?)', batch
+            )
+    database.checkpoint_ledger()
+
+
+class UpdateFactory:
+    """Синтетические обновления от имени пользователей из БД"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}',
+                'username': f'user{user_id}'}
+
+    def command(self, user_id, text):
+        command = text.split()[0]
+        return Update.de_json({
+            'update_id': next(self._update_ids),
+            'message': {
+                'message_id': next(self._update_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': self._user(user_id),
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+            },
+        }, self.bot)
+
+    def callback(self, user_id, data):
+        return Update.de_json({
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._update_ids)),
+                'chat_instance': str(user_id),
+                'data': data,
+                'from': self._user(user_id),
+                'message': {
+                    'message_id': next(self._update_ids),
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'CardBot'},
+                    'text': 'menu',
+                },
+            },
+        }, self.bot)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_phase(name, bot, updates, concurrency, stub, queries):
+    """Прогнать обновления через обработчики и собрать статистику"""
+    app = bot.app
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    calls_before = sum(stub.calls.values())
+    queries_before = queries.count
+
+    async def process(update):
+        async with semaphore:
+            started = time.perf_counter()
+            await app.update_processor.process_update(update, app.process_update(update))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(process(update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    count = len(updates)
+    return {
+        'handler': name,
+        'updates': count,
+        'throughput': count / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'queries': (queries.count - queries_before) / count if count else 0.0,
+        'api_calls': (sum(stub.calls.values()) - calls_before) / count if count else 0.0,
+    }
+
+
+def print_report(results):
+    header = (f"{'обработчик':<14}{'обновл.':>9}{'upd/s':>10}{'p50 мс':>9}"
+              f"{'p95 мс':>9}{'p99 мс':>9}{'SQL/upd':>9}{'API/upd':>9}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['handler']:<14}{r['updates']:>9}{r['throughput']:>10.1f}{r['p50']:>9.2f}"
+              f"{r['p95']:>9.2f}{r['p99']:>9.2f}{r['queries']:>9.2f}{r['api_calls']:>9.2f}")
+
+
+async def run_benchmark(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='cardbot-bench-')
+    try:
+        queries = QueryCounter()
+        database = Database(os.path.join(workdir, 'bench.db'),
+                            pool_size=Config.DB_POOL_SIZE, on_connect=queries.on_connect)
+        stub = StubRequest(latency=args.latency, jitter=args.jitter)
+
+        # Заполняем БД до создания бота, чтобы топ игроков строился по полной базе
+        catalog = CardCatalog(Config.CARDS_PATH, Config.DROP_RATES,
+                              extensions=Config.CARD_EXTENSIONS)
+        started = time.perf_counter()
+        seed_database(database, catalog, args.users, args.cards, rng)
+        print(f"БД заполнена за {time.perf_counter() - started:.1f} с: "
+              f"{args.users} пользователей, ~{args.cards} карточек у каждого")
+
+        Config.METRICS_ENABLED = args.metrics is not None
+        Config.DB_GROUP_COMMIT = args.group_commit
+        Config.ASSETS_CACHE_PATH = os.path.join(workdir, 'assets')
+        # Лимиты Telegram ограничили бы замер 30 сообщениями в секунду
+        Config.FLOOD_LIMIT_ENABLED = args.flood_limit
+        # Случайные повторы нажатий иначе отсеивались бы, не доходя до обработчиков
+        Config.CALLBACK_GUARD_ENABLED = args.callback_guard
+        bot = CardBot(database=database, request=stub)
+        await bot.app.initialize()
+        factory = UpdateFactory(bot.app.bot)
+
+        def users():
+            return [rng.randint(1, args.users) for _ in range(args.updates)]
+
+        def sell_commands():
+            with database.transaction() as conn:
+                rows = conn.execute('''
+                    SELECT user_id, MAX(id) as id FROM user_cards
+                    WHERE is_sold = 0
+                    GROUP BY user_id
+                ''').fetchall()
+            rows = rng.sample(rows, min(len(rows), args.updates))
+            return [factory.command(row['user_id'], f"/sell {row['id']}") for row in rows]
+
+        phases = [
+            ('start', lambda: [factory.command(u, '/start') for u in users()]),
+            ('open_box', lambda: [factory.callback(u, 'open_box') for u in users()]),
+            ('open_all', lambda: [factory.callback(u, 'open_all') for u in users()]),
+            ('my_cards', lambda: [factory.callback(u, 'my_cards') for u in users()]),
+            ('cards_grouped', lambda: [factory.callback(u, 'cards:g') for u in users()]),
+            ('top_players', lambda: [factory.callback(u, 'top_players') for u in users()]),
+            ('show_balance', lambda: [factory.callback(u, 'show_balance') for u in users()]),
+            ('sell', sell_commands),
+            ('sell_all', lambda: [factory.callback(u, 'sell_all') for u in users()]),
+        ]
+        if args.only:
+            phases = [phase for phase in phases if phase[0] in args.only]
+
+        results = []
+        for name, build in phases:
+            if name in ('open_box', 'open_all'):
+                # У всех полные заряды - измеряем полный путь открытия
+                with database.transaction() as conn:
+                    conn.execute('UPDATE users SET charges_from = NULL')
+                bot.cooldowns.load([])
+            results.append(await run_phase(name, bot, build(), args.concurrency, stub, queries))
+
+        print_report(results)
+        print(f"\nВызовы Bot API: {dict(stub.calls)}")
+        if bot.metrics is not None:
+            with open(args.metrics, 'w', encoding='utf-8') as f:
+                f.write(bot.metrics.render())
+            print(f"Метрики записаны в {args.metrics}")
+
+        await bot.app.shutdown()
+        bot.db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест CardBot на заглушке Bot API")
+    parser.add_argument('--users', type=int, default=1000, help="пользователей в БД")
+    parser.add_argument('--cards', type=int, default=20, help="карточек у пользователя в среднем")
+    parser.add_argument('--updates', type=int, default=1000, help="обновлений на обработчик")
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help="сколько обновлений подаётся одновременно")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="задержка ответа Bot API, с")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="случайная добавка к задержке, с")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', nargs='*', help="запустить только указанные обработчики")
+    parser.add_argument('--flood-limit', action='store_true',
+                        help="включить ограничение исходящих сообщений под лимиты Telegram")
+    parser.add_argument('--callback-guard', action='store_true',
+                        help="отсеивать повторные и слишком частые нажатия на кнопки")
+    parser.add_argument('--group-commit', action='store_true',
+                        help="фиксировать записи в БД пачками (GroupCommitWriter)")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="включить метрики и сохранить их в файл в формате Prometheus")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
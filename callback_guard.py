@@ -0,0 +1,61 @@
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+THROTTLED = 'throttled'
+
+
+class CallbackGuard:
+    """Допуск нажатий на кнопки к обработчикам.
+
+    Повтор той же кнопки (те же callback_data) в течение window секунд
+    после обработки предыдущего нажатия отбрасывается: обновления одного
+    пользователя обрабатываются по очереди, поэтому частые нажатия
+    проверяются сразу после завершения первого. Кроме того, от одного
+    пользователя принимается в среднем не больше rate нажатий в секунду
+    (подряд - до burst). Решение принимается только по памяти; хранятся
+    max_size последних пользователей.
+    """
+
+    def __init__(self, window=1.0, rate=2.0, burst=5, max_size=10000):
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        # user_id -> [callback_data последнего принятого нажатия, когда оно
+        #             принято или обработано, токены, время пополнения]
+        self._users = OrderedDict()
+
+    def admit(self, user_id, data, now=None):
+        """Решение по нажатию: ACCEPTED, DUPLICATE или THROTTLED"""
+        now = time.monotonic() if now is None else now
+        state = self._users.get(user_id)
+        if state is None:
+            state = [None, None, float(self.burst), now]
+            self._users[user_id] = state
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+            state[2] = min(float(self.burst), state[2] + (now - state[3]) * self.rate)
+            state[3] = now
+
+        last_data, last_at = state[0], state[1]
+        if last_data is not None and data == last_data and now - last_at < self.window:
+            return DUPLICATE
+        if state[2] < 1:
+            return THROTTLED
+        state[0] = data
+        state[1] = now
+        state[2] -= 1
+        return ACCEPTED
+
+    def finish(self, user_id, data, now=None):
+        """Отметить конец обработки принятого нажатия - от него отсчитывается window"""
+        state = self._users.get(user_id)
+        if state is not None and state[0] == data:
+            state[1] = time.monotonic() if now is None else now
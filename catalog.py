@@ -0,0 +1,156 @@
+import os
+import time
+import random
+import logging
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class Card(NamedTuple):
+    name: str
+    rarity: str
+    path: str
+
+
+class AliasSampler:
+    """Выбор элемента по весам за O(1) (метод псевдонимов, алгоритм Vose)"""
+
+    def __init__(self, items, weights):
+        if not items or len(items) != len(weights):
+            raise ValueError("Нужен хотя бы один элемент и вес для каждого элемента")
+        total = float(sum(weights))
+        if total <= 0:
+            raise ValueError("Сумма весов должна быть положительной")
+
+        n = len(items)
+        self.items = tuple(items)
+        self.probabilities = tuple(w / total for w in weights)
+        prob = [0.0] * n
+        alias = [0] * n
+
+        scaled = [p * n for p in self.probabilities]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Остатки из-за погрешности округления
+        for i in small + large:
+            prob[i] = 1.0
+
+        self._prob = tuple(prob)
+        self._alias = tuple(alias)
+
+    def sample(self, rng=random):
+        i = int(rng.random() * len(self.items))
+        if rng.random() < self._prob[i]:
+            return self.items[i]
+        return self.items[self._alias[i]]
+
+
+class CatalogSnapshot(NamedTuple):
+    cards: dict
+    sampler: AliasSampler
+    signature: tuple
+
+
+class CardCatalog:
+    """Индекс карточек по редкостям, построенный по папкам data/<редкость>/.
+
+    Папки сканируются один раз; повторное сканирование происходит только
+    когда меняется время изменения каталога или одной из папок редкостей,
+    и проверяется не чаще раза в reload_interval секунд.
+    """
+
+    def __init__(self, root, drop_rates, extensions=('.png', '.jpg', '.jpeg', '.gif'),
+                 reload_interval=30.0):
+        self.root = root
+        self.drop_rates = dict(drop_rates)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.reload_interval = reload_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self.reload()
+
+    def _signature(self):
+        """Время изменения корня и папок редкостей - меняется при добавлении/удалении файлов"""
+        parts = [os.stat(self.root).st_mtime_ns]
+        for rarity in self.drop_rates:
+            try:
+                parts.append(os.stat(os.path.join(self.root, rarity)).st_mtime_ns)
+            except FileNotFoundError:
+                parts.append(None)
+        return tuple(parts)
+
+    def _scan(self, signature):
+        cards = {}
+        for rarity in self.drop_rates:
+            rarity_path = os.path.join(self.root, rarity)
+            if not os.path.isdir(rarity_path):
+                logger.warning(f"Папка редкости не найдена: {rarity_path}")
+                continue
+            found = tuple(
+                Card(os.path.splitext(f)[0], rarity, os.path.join(rarity_path, f))
+                for f in sorted(os.listdir(rarity_path))
+                if f.lower().endswith(self.extensions)
+            )
+            if found:
+                cards[rarity] = found
+            else:
+                logger.warning(f"В папке {rarity_path} нет карточек")
+
+        for entry in os.listdir(self.root):
+            if os.path.isdir(os.path.join(self.root, entry)) and entry not in self.drop_rates:
+                logger.warning(f"Папка {entry} не указана в таблице выпадения и пропущена")
+
+        sampler = None
+        if cards:
+            rarities = list(cards)
+            sampler = AliasSampler(rarities, [self.drop_rates[r] for r in rarities])
+        return CatalogSnapshot(cards, sampler, signature)
+
+    def reload(self):
+        """Пересканировать папки с карточками"""
+        self._snapshot = self._scan(self._signature())
+        self._checked_at = time.monotonic()
+        total = sum(len(cards) for cards in self._snapshot.cards.values())
+        logger.info(f"Каталог карточек загружен: {total} шт.")
+
+    def maybe_reload(self):
+        """Пересканировать, если содержимое папок изменилось"""
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            signature = self._signature()
+        except OSError as e:
+            logger.error(f"Ошибка при проверке каталога карточек: {e}")
+            return
+        if signature != self._snapshot.signature:
+            self.reload()
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def expected_rates(self):
+        """Фактические вероятности редкостей с учётом пустых папок"""
+        sampler = self._snapshot.sampler
+        if sampler is None:
+            return {}
+        return dict(zip(sampler.items, sampler.probabilities))
+
+    def random_card(self, rng=random):
+        """Случайная карточка с учётом таблицы выпадения или None, если карточек нет"""
+        self.maybe_reload()
+        snapshot = self._snapshot
+        if snapshot.sampler is None:
+            return None
+        cards = snapshot.cards[snapshot.sampler.sample(rng)]
+        return cards[int(rng.random() * len(cards))]
@@ -10,6 +10,14 @@ class Config:
     # ID вашего канала (можно получить через @username_to_id_bot)
     CHANNEL_ID = -1002195866325
 
+    # Сколько помнить результат проверки подписки (в секундах)
+    SUBSCRIPTION_POSITIVE_TTL = 600
+    SUBSCRIPTION_NEGATIVE_TTL = 30
+    SUBSCRIPTION_CACHE_SIZE = 10000
+
+    # Сколько игроков сверх топ-10 держать в памяти про запас
+    LEADERBOARD_SLACK = 20
+
     # Цены за карточки
     PRICES = {
         "Обычный": 10,
@@ -19,8 +27,144 @@ class Config:
         "Секрет": 100
     }
 
+    # Сколько id/диапазонов можно передать в /sell за раз
+    SELL_MAX_ARGS = 50
+
+    # Размер страницы в /cards (обычный и сгруппированный режим)
+    CARDS_PAGE_SIZE = 10
+    CARDS_GROUPED_PAGE_SIZE = 20
+
     # Путь к папке с карточками
     CARDS_PATH = "data"
 
-    # Время между открытиями в секундах (1 час)
-    COOLDOWN_SECONDS = 3600
\ No newline at end of file
+    # Шансы выпадения редкостей (в процентах)
+    DROP_RATES = {
+        "Обычный": 40,
+        "Редкий": 30,
+        "Легендарный": 15,
+        "Мифик": 10,
+        "Секрет": 5
+    }
+
+    # Расширения файлов карточек
+    CARD_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+    # Как часто проверять папку с карточками на изменения (в секундах)
+    CATALOG_RELOAD_INTERVAL = 30
+
+    # Обработанные для Telegram изображения карточек (нужен Pillow):
+    # не больше ASSET_MAX_SIDE пикселей по большей стороне, JPEG или WEBP
+    ASSETS_ENABLED = True
+    ASSETS_CACHE_PATH = "asset_cache"
+    ASSET_MAX_SIDE = 1280
+    ASSET_QUALITY = 85
+    ASSET_FORMAT = "JPEG"
+    # Процессы для обработки (None - по числу ядер)
+    ASSET_WORKERS = None
+
+    # Время накопления одного ящика в секундах (1 час)
+    COOLDOWN_SECONDS = 3600
+
+    # Сколько ящиков может накопиться и сколько открывается кнопкой "Открыть все"
+    # (альбом в Telegram - не больше 10 фото)
+    MAX_CHARGES = 5
+    OPEN_ALL_LIMIT = 10
+
+    # Уведомлять, когда накопился ящик (нужен JobQueue: python-telegram-bot[job-queue]),
+    # и с какой точностью в секундах. По умолчанию выключено: каждое уведомление -
+    # отдельное сообщение, которого игрок не просил
+    READY_NOTIFICATIONS = False
+    READY_TICK_SECONDS = 60
+
+    # Как часто забывать игроков с полными зарядами (в секундах)
+    COOLDOWN_PRUNE_SECONDS = 600
+
+    # Как часто переносить журнал баланса в users.balance (в секундах)
+    LEDGER_CHECKPOINT_SECONDS = 300
+
+    # Архивация проданных карточек: проданные раньше ARCHIVE_AFTER_DAYS дней
+    # назад переносятся в user_cards_archive пачками по ARCHIVE_BATCH_SIZE
+    # (каждая - отдельная короткая транзакция), не больше ARCHIVE_MAX_PER_RUN
+    # за запуск; затем освободившееся место возвращается по VACUUM_STEP_PAGES страниц
+    ARCHIVE_ENABLED = True
+    ARCHIVE_AFTER_DAYS = 30
+    ARCHIVE_INTERVAL_SECONDS = 3600
+    ARCHIVE_BATCH_SIZE = 500
+    ARCHIVE_MAX_PER_RUN = 50000
+    VACUUM_STEP_PAGES = 1000
+
+    # Файл базы данных и размер пула соединений
+    DB_PATH = "bot_database.db"
+    DB_POOL_SIZE = 4
+
+    # Потоки для чтения из БД (запись всегда идёт в одном отдельном потоке)
+    DB_READ_THREADS = 3
+
+    # Групповая фиксация записей: пачка до DB_GROUP_COMMIT_MAX_BATCH операций
+    # или за DB_GROUP_COMMIT_INTERVAL_MS миллисекунд фиксируется одной транзакцией.
+    # DB_DURABILITY: "normal" или "full" (сброс на диск при каждой фиксации)
+    DB_GROUP_COMMIT = False
+    DB_GROUP_COMMIT_MAX_BATCH = 64
+    DB_GROUP_COMMIT_INTERVAL_MS = 5
+    DB_DURABILITY = "normal"
+
+    # Метрики Prometheus на локальном порту (GET /metrics); выключены - без накладных расходов
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+    METRICS_HOST = "127.0.0.1"
+    METRICS_PORT = 9100
+
+    # Вызовы БД дольше этого порога (мс) попадают в лог как медленные
+    SLOW_QUERY_MS = 100
+
+    # Сколько обновлений обрабатывать одновременно (у одного пользователя - всегда по очереди)
+    CONCURRENT_UPDATES = 32
+
+    # Лимиты исходящих сообщений Telegram: всего в секунду, в личный чат
+    # в секунду (с небольшим запасом на всплеск) и в группу в минуту
+    FLOOD_LIMIT_ENABLED = True
+    FLOOD_GLOBAL_RATE = 30
+    FLOOD_CHAT_RATE = 1
+    FLOOD_CHAT_BURST = 3
+    FLOOD_GROUP_PER_MINUTE = 20
+    # Сколько раз повторять запрос после ответа 429 (RetryAfter)
+    FLOOD_MAX_RETRIES = 3
+
+    # Получение обновлений: "polling" (по умолчанию) или "webhook"
+    UPDATE_MODE = os.getenv("UPDATE_MODE", "polling")
+
+    # Публичный адрес webhook для setWebhook; если пуст, сервер работает без
+    # регистрации в Telegram (например, для локальной проверки POST-запросами)
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_LISTEN = "0.0.0.0"
+    WEBHOOK_PORT = 8443
+    WEBHOOK_PATH = "/telegram"
+    # Обязателен, если WEBHOOK_LISTEN - не локальный адрес: без него сервер не запускается
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+    # Очередь входящих обновлений и число одновременно обрабатываемых
+    WEBHOOK_QUEUE_SIZE = 1000
+    WEBHOOK_WORKERS = 64
+    # Сколько соединений Telegram может открыть к серверу (1-100)
+    WEBHOOK_MAX_CONNECTIONS = 40
+
+    # Нажатия на кнопки: повтор той же кнопки в течение CALLBACK_DEBOUNCE_SECONDS
+    # после предыдущего отбрасывается, всего от пользователя - не больше
+    # CALLBACK_RATE нажатий в секунду (подряд до CALLBACK_BURST)
+    CALLBACK_GUARD_ENABLED = True
+    CALLBACK_DEBOUNCE_SECONDS = 1.0
+    CALLBACK_RATE = 2
+    CALLBACK_BURST = 5
+    CALLBACK_GUARD_SIZE = 10000
+    # Для скольких сообщений помнить последний отправленный текст и кнопки
+    # (правка с тем же содержимым не отправляется)
+    EDIT_CACHE_SIZE = 10000
+
+    # Рабочих процессов бота: больше 1 - супервизор раздаёт обновления
+    # процессам по id игрока (см. supervisor.py)
+    WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+    # Сколько обновлений может ждать подтверждения у одного процесса
+    WORKER_MAX_IN_FLIGHT = 1000
+    # Пауза перед перезапуском упавшего процесса (в секундах)
+    WORKER_RESTART_DELAY = 1
+    # Как часто процессы перечитывают топ игроков из БД (в секундах)
+    LEADERBOARD_REFRESH_SECONDS = 30
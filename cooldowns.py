@@ -0,0 +1,111 @@
+import logging
+from datetime import datetime, timedelta
+
+from database import count_charges
+
+logger = logging.getLogger(__name__)
+
+
+class CooldownService:
+    """Заряды игроков в памяти и таймеры "ящик готов".
+
+    При запуске загружаются игроки с неполными зарядами (у остальных
+    заряды полные и хранить их не нужно). Проверка зарядов не обращается
+    к БД; после каждого открытия сюда записывается новый charges_from из
+    той же транзакции, что и в БД.
+
+    Таймеры хранятся в колесе с шагом tick секунд: слот - номер интервала
+    времени, в котором у игрока появится заряд, в слоте - множество id.
+    Перенос таймера - O(1), а задача в JobQueue одна на всех: раз в tick
+    секунд она забирает наступившие слоты. Без уведомлений (timers=False)
+    таймеры не заводятся. Игроков, у которых заряды накопились полностью,
+    убирает prune - его нужно вызывать периодически в любом режиме.
+    """
+
+    def __init__(self, cooldown_seconds=3600, max_charges=1, tick=60, timers=True):
+        self.cooldown_seconds = cooldown_seconds
+        self.max_charges = max_charges
+        self.tick = tick
+        self.timers = timers
+        # user_id -> charges_from (только для игроков с неполными зарядами)
+        self._charges_from = {}
+        # номер слота -> множество user_id
+        self._wheel = {}
+        # user_id -> номер слота
+        self._slots = {}
+        # Слоты до этого номера уже обработаны
+        self._next_slot = self._slot(datetime.now())
+
+    @property
+    def pending_timers(self):
+        return len(self._slots)
+
+    def _slot(self, moment):
+        return int(moment.timestamp() // self.tick)
+
+    def load(self, rows):
+        """Заполнить из БД: строки (user_id, charges_from)"""
+        now = datetime.now()
+        self._charges_from.clear()
+        self._wheel.clear()
+        self._slots.clear()
+        for user_id, charges_from in rows:
+            self.update(user_id, charges_from, now)
+
+    def charges(self, user_id, now=None):
+        """Заряды игрока: (сколько есть, секунд до следующего)"""
+        return count_charges(self._charges_from.get(user_id), now or datetime.now(),
+                             self.cooldown_seconds, self.max_charges)
+
+    def update(self, user_id, charges_from, now=None):
+        """Запомнить charges_from игрока после записи в БД"""
+        if isinstance(charges_from, str):
+            charges_from = datetime.fromisoformat(charges_from)
+        now = now or datetime.now()
+        self._unschedule(user_id)
+        charges, _ = count_charges(charges_from, now, self.cooldown_seconds, self.max_charges)
+        if charges >= self.max_charges:
+            self._charges_from.pop(user_id, None)
+            return
+        self._charges_from[user_id] = charges_from
+        if charges == 0 and self.timers:
+            ready_at = charges_from + timedelta(seconds=self.cooldown_seconds)
+            slot = max(self._slot(ready_at) + 1, self._next_slot)
+            self._wheel.setdefault(slot, set()).add(user_id)
+            self._slots[user_id] = slot
+
+    def _unschedule(self, user_id):
+        slot = self._slots.pop(user_id, None)
+        if slot is not None:
+            users = self._wheel[slot]
+            users.discard(user_id)
+            if not users:
+                del self._wheel[slot]
+
+    def pop_due(self, now=None):
+        """Игроки, у которых с прошлого вызова появился заряд"""
+        current = self._slot(now or datetime.now())
+        due = []
+        # Слоты пустеют по мере переносов, поэтому идём только по существующим
+        if current - self._next_slot > len(self._wheel):
+            slots = sorted(slot for slot in self._wheel if slot <= current)
+        else:
+            slots = [slot for slot in range(self._next_slot, current + 1) if slot in self._wheel]
+        for slot in slots:
+            for user_id in self._wheel.pop(slot):
+                del self._slots[user_id]
+                due.append(user_id)
+        self._next_slot = current + 1
+        return due
+
+    def prune(self, now=None):
+        """Забыть игроков, у которых заряды уже полные"""
+        now = now or datetime.now()
+        full = [
+            user_id for user_id, charges_from in self._charges_from.items()
+            if count_charges(charges_from, now, self.cooldown_seconds,
+                             self.max_charges)[0] >= self.max_charges
+        ]
+        for user_id in full:
+            del self._charges_from[user_id]
+        return len(full)
@@ -1,21 +1,186 @@
+import os
+import time
+import queue
+import asyncio
 import sqlite3
 import logging
-from datetime import datetime
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import NamedTuple
+from datetime import datetime, timedelta
 from contextlib import contextmanager
 
+from migrations import migrate
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Текущий баланс: снимок в users.balance плюс записи журнала после
+# последней контрольной точки (см. checkpoint_ledger)
+LIVE_BALANCE = '''
+    users.balance + COALESCE((
+        SELECT SUM(amount) FROM balance_ledger
+        WHERE balance_ledger.user_id = users.user_id
+          AND balance_ledger.id > (SELECT MAX(ledger_id) FROM ledger_checkpoints)
+    ), 0)
+'''
+
+# Строка пользователя для подписчиков user_listeners
+USER_ROW = f'user_id, username, {LIVE_BALANCE} AS balance, card_count'
+
+
+class OpenBoxResult(NamedTuple):
+    # id новых карточек (по порядку переданных карточек); пусто, если зарядов нет
+    card_ids: list
+    # Сколько карточек у пользователя после открытия
+    card_count: int
+    # Сколько зарядов осталось
+    charges: int
+    # Сколько секунд до следующего заряда (0, если заряды полные)
+    next_charge_in: float
+    # Момент, с которого копятся заряды, после открытия
+    charges_from: datetime
+
+
+def count_charges(charges_from, now, cooldown_seconds, max_charges):
+    """Заряды для открытия ящика: (сколько есть, секунд до следующего).
+
+    Заряд набирается каждые cooldown_seconds, но не больше max_charges.
+    charges_from - момент, с которого заряды копятся с нуля (None - полные).
+    """
+    if charges_from is None:
+        return max_charges, 0
+    if isinstance(charges_from, str):
+        charges_from = datetime.fromisoformat(charges_from)
+    elapsed = max((now - charges_from).total_seconds(), 0)
+    charges = min(max_charges, int(elapsed // cooldown_seconds))
+    if charges >= max_charges:
+        return charges, 0
+    return charges, cooldown_seconds - elapsed % cooldown_seconds
+
+
+class SellResult(NamedTuple):
+    sold_count: int
+    total_price: int
+    # Баланс и число карточек после продажи
+    balance: int
+    card_count: int
+
+
+class CardsPage(NamedTuple):
+    # Карточки (или группы одинаковых карточек) на странице
+    rows: list
+    has_prev: bool
+    has_next: bool
+    # Число непроданных карточек по редкостям
+    rarity_counts: dict
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite.
+
+    Соединения открываются один раз и настраиваются под нагрузку бота:
+    WAL позволяет читать параллельно с записью, а кэш подготовленных
+    выражений sqlite3 переиспользуется между вызовами.
+    """
+
+    def __init__(self, db_name, size=4, cache_size_kb=8192, busy_timeout=5.0,
+                 cached_statements=256, on_connect=None):
+        self.db_name = db_name
+        self.size = size
+        self.cache_size_kb = cache_size_kb
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        # Дополнительная настройка каждого нового соединения
+        self.on_connect = on_connect
+        # LIFO: чаще используются "тёплые" соединения с прогретым кэшем
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        # Действует только для нового файла (до journal_mode, который его создаёт):
+        # место после архивации возвращается incremental_vacuum. У существующей
+        # БД режим меняет только VACUUM (python archive.py vacuum)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
 class Database:
-    def __init__(self, db_name="bot_database.db"):
+    def __init__(self, db_name="bot_database.db", pool_size=4, on_connect=None):
         self.db_name = db_name
+        self.pool = ConnectionPool(db_name, size=pool_size, on_connect=on_connect)
+        # Соединение текущей транзакции (см. transaction())
+        self._local = threading.local()
+        # Каталог карточек из таблицы cards: file_path -> id и id -> редкость
+        self._card_ids = {}
+        self._card_rarities = {}
+        # Подписчики на изменения баланса/коллекции:
+        # fn(user_id, username, balance, card_count), вызываются после фиксации
+        self.user_listeners = []
         self.init_db()
 
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row
+        shared = getattr(self._local, 'conn', None)
+        if shared is not None:
+            # Внутри transaction(): фиксирует изменения внешний уровень
+            yield shared
+            return
+
+        conn = self.pool.acquire()
         try:
             yield conn
             conn.commit()
@@ -24,36 +189,54 @@ class Database:
             logger.error(f"Database error: {e}")
             raise
         finally:
-            conn.close()
+            self.pool.release(conn)
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Выполнить несколько операций на одном соединении в одной транзакции.
+
+        immediate=True сразу берёт блокировку на запись (BEGIN IMMEDIATE),
+        чтобы проверка и последующее изменение не разошлись.
+        """
+        shared = getattr(self._local, 'conn', None)
+        if shared is not None:
+            yield shared
+            return
+
+        with self.get_connection() as conn:
+            if immediate:
+                conn.execute('BEGIN IMMEDIATE')
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+
+    def close(self):
+        self.pool.close()
+
+    def invalidate_caches(self):
+        """Сбросить кэш каталога cards (после отката транзакции, которая могла его дополнить)"""
+        self._card_ids = {}
+        self._card_rarities = {}
 
     def init_db(self):
         with self.get_connection() as conn:
-            cursor = conn.cursor()
+            version = migrate(conn)
+            logger.info(f"Версия схемы БД: {version}")
 
-            # Таблица пользователей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    balance INTEGER DEFAULT 0,
-                    last_opened TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Таблица карточек пользователей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_cards (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    card_name TEXT,
-                    rarity TEXT,
-                    file_path TEXT,
-                    obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_sold BOOLEAN DEFAULT FALSE,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
+    def _notify(self, user):
+        """Сообщить подписчикам о новом состоянии пользователя (строка users)"""
+        deferred = getattr(self._local, 'deferred', None)
+        if deferred is not None:
+            # Внутри пачки GroupCommitWriter: сообщим после фиксации
+            deferred.append(user)
+            return
+        for listener in self.user_listeners:
+            try:
+                listener(user['user_id'], user['username'], user['balance'], user['card_count'])
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике изменений пользователя: {e}")
 
     def add_user(self, user_id, username):
         with self.get_connection() as conn:
@@ -61,115 +244,561 @@ class Database:
             cursor.execute('''
                 INSERT OR IGNORE INTO users (user_id, username) 
                 VALUES (?, ?)
+                RETURNING user_id, username, balance, card_count
             ''', (user_id, username))
+            user = cursor.fetchone()
+        if user:
+            self._notify(user)
 
     def get_user(self, user_id):
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            cursor.execute(f'''
+                SELECT user_id, username, {LIVE_BALANCE} AS balance,
+                       last_opened, created_at, card_count, charges_from
+                FROM users WHERE user_id = ?
+            ''', (user_id,))
             return cursor.fetchone()
 
-    def update_balance(self, user_id, amount):
-        with self.get_connection() as conn:
+    @staticmethod
+    def _record(cursor, user_id, amount, reason, ref=None):
+        """Добавить запись в журнал баланса и вернуть строку пользователя"""
+        cursor.execute('''
+            INSERT INTO balance_ledger (user_id, amount, reason, ref, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, amount, reason, ref, datetime.now()))
+        cursor.execute(f'SELECT {USER_ROW} FROM users WHERE user_id = ?', (user_id,))
+        return cursor.fetchone()
+
+    def update_balance(self, user_id, amount, reason='grant', ref=None):
+        """Изменить баланс записью в журнал (reason - причина: grant, spend, ...)"""
+        with self.transaction() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE users 
-                SET balance = balance + ? 
-                WHERE user_id = ?
-            ''', (amount, user_id))
-            return cursor.rowcount > 0
+            cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
+            if cursor.fetchone() is None:
+                return False
+            user = self._record(cursor, user_id, amount, reason, ref)
+        self._notify(user)
+        return True
 
-    def update_last_opened(self, user_id):
-        with self.get_connection() as conn:
+    def checkpoint_ledger(self):
+        """Перенести в users.balance записи журнала после последней контрольной точки.
+
+        Снимок и новая контрольная точка меняются в одной транзакции, поэтому
+        текущий баланс (LIVE_BALANCE) не меняется. Возвращает число записей.
+        """
+        with self.transaction(immediate=True) as conn:
             cursor = conn.cursor()
+            cursor.execute('SELECT MAX(ledger_id) FROM ledger_checkpoints')
+            last = cursor.fetchone()[0]
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM balance_ledger')
+            head = cursor.fetchone()[0]
+            if head <= last:
+                return 0
             cursor.execute('''
-                UPDATE users 
-                SET last_opened = ? 
-                WHERE user_id = ?
-            ''', (datetime.now(), user_id))
+                UPDATE users
+                SET balance = users.balance + delta.total
+                FROM (
+                    SELECT user_id, SUM(amount) AS total
+                    FROM balance_ledger
+                    WHERE id > ? AND id <= ?
+                    GROUP BY user_id
+                ) AS delta
+                WHERE users.user_id = delta.user_id
+            ''', (last, head))
+            cursor.execute('INSERT INTO ledger_checkpoints (ledger_id, created_at) VALUES (?, ?)',
+                           (head, datetime.now()))
+            return head - last
 
-    def can_open_box(self, user_id):
+    def get_charge_clocks(self, since):
+        """(user_id, charges_from) игроков, у которых заряды копятся после since"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT last_opened FROM users WHERE user_id = ?', (user_id,))
-            user = cursor.fetchone()
-
-            if not user or not user['last_opened']:
-                return True
+            cursor.execute('''
+                SELECT user_id, charges_from FROM users
+                WHERE charges_from > ?
+            ''', (since,))
+            return [(row['user_id'], row['charges_from']) for row in cursor.fetchall()]
 
-            last_opened = datetime.fromisoformat(user['last_opened'])
-            time_passed = (datetime.now() - last_opened).total_seconds()
-            return time_passed >= 3600  # 1 час
+    def get_card_id(self, card_name, rarity, file_path):
+        """id карточки в каталоге cards; новая карточка добавляется при первом обращении"""
+        file_path = file_path.replace(os.sep, '/')
+        card_id = self._card_ids.get(file_path)
+        if card_id is not None:
+            return card_id
 
-    def add_card(self, user_id, card_name, rarity, file_path):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO user_cards (user_id, card_name, rarity, file_path)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, card_name, rarity, file_path))
-            return cursor.lastrowid
+                INSERT INTO cards (name, rarity, file_path)
+                VALUES (?, ?, ?)
+                ON CONFLICT (file_path) DO UPDATE SET name = excluded.name, rarity = excluded.rarity
+                RETURNING id
+            ''', (card_name, rarity, file_path))
+            card_id = cursor.fetchone()['id']
 
-    def sell_card(self, card_id, user_id):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            # Получаем редкость карточки
-            cursor.execute('''
-                SELECT rarity FROM user_cards 
-                WHERE id = ? AND user_id = ? AND is_sold = 0
-            ''', (card_id, user_id))
-            card = cursor.fetchone()
+        self._card_ids[file_path] = card_id
+        self._card_rarities[card_id] = rarity
+        return card_id
 
-            if card:
-                # Помечаем как проданную
-                cursor.execute('''
-                    UPDATE user_cards 
-                    SET is_sold = 1 
-                    WHERE id = ? AND user_id = ?
-                ''', (card_id, user_id))
-                return card['rarity']
-            return None
+    def get_card_rarity(self, card_id):
+        rarity = self._card_rarities.get(card_id)
+        if rarity is None:
+            with self.get_connection() as conn:
+                for row in conn.execute('SELECT id, rarity, file_path FROM cards'):
+                    self._card_rarities[row['id']] = row['rarity']
+                    self._card_ids[row['file_path']] = row['id']
+            rarity = self._card_rarities.get(card_id)
+        return rarity
 
     def get_user_cards(self, user_id, unsold_only=True):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             if unsold_only:
                 cursor.execute('''
-                    SELECT * FROM user_cards 
+                    SELECT * FROM user_cards_full 
                     WHERE user_id = ? AND is_sold = 0 
                     ORDER BY obtained_at DESC
                 ''', (user_id,))
             else:
+                # Вся история, включая перенесённые в архив проданные карточки
                 cursor.execute('''
-                    SELECT * FROM user_cards 
+                    SELECT * FROM user_cards_history 
                     WHERE user_id = ? 
                     ORDER BY obtained_at DESC
                 ''', (user_id,))
             return cursor.fetchall()
 
+    def archive_sold_cards(self, sold_before, batch_size=500):
+        """Перенести в архив пачку карточек, проданных раньше sold_before; вернуть их число"""
+        oldest = '''
+            SELECT id FROM user_cards
+            WHERE is_sold = 1 AND sold_at < ?
+            ORDER BY sold_at, id
+            LIMIT ?
+        '''
+        with self.transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                INSERT INTO user_cards_archive (id, user_id, card_id, obtained_at, sold_at)
+                SELECT id, user_id, card_id, obtained_at, sold_at FROM user_cards
+                WHERE id IN ({oldest})
+            ''', (sold_before, batch_size))
+            moved = cursor.rowcount
+            if moved:
+                # Проданные карточки не входят в card_count - триггер удаления их не учитывает
+                cursor.execute(f'DELETE FROM user_cards WHERE id IN ({oldest})',
+                               (sold_before, batch_size))
+            return moved
+
+    def incremental_vacuum(self, pages=1000):
+        """Вернуть ОС до pages свободных страниц файла.
+
+        Возвращает число оставшихся свободных страниц или None, если у БД
+        не включён auto_vacuum = INCREMENTAL.
+        """
+        with self.get_connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                return None
+            conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+            return conn.execute('PRAGMA freelist_count').fetchone()[0]
+
     def get_top_players(self, limit=10):
+        """Лучшие игроки по снимку users.balance - актуален после checkpoint_ledger"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT 
-                    u.user_id,
-                    u.username,
-                    u.balance,
-                    COUNT(uc.id) as card_count
-                FROM users u
-                LEFT JOIN user_cards uc ON u.user_id = uc.user_id AND uc.is_sold = 0
-                GROUP BY u.user_id
-                ORDER BY u.balance DESC, card_count DESC
+                SELECT user_id, username, balance, card_count
+                FROM users
+                ORDER BY balance DESC, card_count DESC
                 LIMIT ?
             ''', (limit,))
             return cursor.fetchall()
 
-    def get_card_count(self, user_id):
+    def get_photo_file_id(self, file_path, content_hash):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT COUNT(*) as count 
-                FROM user_cards 
-                WHERE user_id = ? AND is_sold = 0
-            ''', (user_id,))
-            return cursor.fetchone()['count']
\ No newline at end of file
+                SELECT file_id FROM photo_cache 
+                WHERE file_path = ? AND content_hash = ?
+            ''', (file_path, content_hash))
+            row = cursor.fetchone()
+            return row['file_id'] if row else None
+
+    def save_photo_file_id(self, file_path, content_hash, file_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO photo_cache (file_path, content_hash, file_id, updated_at)
+                VALUES (?, ?, ?, ?)
+            ''', (file_path, content_hash, file_id, datetime.now()))
+
+    def delete_photo_file_id(self, file_path):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM photo_cache WHERE file_path = ?', (file_path,))
+
+    def get_user_stats(self, user_id):
+        """Пользователь и число его карточек (users.card_count) одним запросом"""
+        user = self.get_user(user_id)
+        return user, user['card_count'] if user else 0
+
+    def open_boxes_atomic(self, user_id, cards, cooldown_seconds=3600, max_charges=1):
+        """Открыть до len(cards) ящиков: списание зарядов и выдача карточек одной транзакцией.
+
+        Выдаётся столько карточек из cards (по порядку), сколько у
+        пользователя зарядов. Транзакция начинается с BEGIN IMMEDIATE,
+        поэтому два одновременных нажатия не потратят одни заряды дважды.
+        """
+        now = datetime.now()
+        card_ids = [self.get_card_id(card.name, card.rarity, card.path) for card in cards]
+        with self.transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+            cursor.execute('SELECT charges_from FROM users WHERE user_id = ?', (user_id,))
+            charges_from = cursor.fetchone()['charges_from']
+            if charges_from is not None:
+                charges_from = datetime.fromisoformat(charges_from)
+            charges, next_charge_in = count_charges(charges_from, now, cooldown_seconds, max_charges)
+            if charges == 0 or not card_ids:
+                return OpenBoxResult([], None, charges, next_charge_in, charges_from)
+
+            taken = min(charges, len(card_ids))
+            # Заряды сверх лимита не копятся - отсчёт не раньше момента полного заряда
+            full_from = now - timedelta(seconds=cooldown_seconds * max_charges)
+            start = full_from if charges_from is None else max(charges_from, full_from)
+            charges_from = start + timedelta(seconds=cooldown_seconds * taken)
+            cursor.execute('''
+                UPDATE users
+                SET charges_from = ?, last_opened = ?
+                WHERE user_id = ?
+            ''', (charges_from, now, user_id))
+
+            cursor.execute(f'''
+                INSERT INTO user_cards (user_id, card_id)
+                VALUES {', '.join(['(?, ?)'] * taken)}
+                RETURNING id
+            ''', [value for card_id in card_ids[:taken] for value in (user_id, card_id)])
+            # id выдаются по возрастанию в порядке строк
+            user_card_ids = sorted(row['id'] for row in cursor.fetchall())
+
+            cursor.execute(f'SELECT {USER_ROW} FROM users WHERE user_id = ?', (user_id,))
+            user = cursor.fetchone()
+
+        self._notify(user)
+        charges, next_charge_in = count_charges(charges_from, now, cooldown_seconds, max_charges)
+        return OpenBoxResult(user_card_ids, user['card_count'], charges, next_charge_in, charges_from)
+
+    def sell_cards(self, user_id, prices, card_ids=(), id_ranges=(), rarity=None):
+        """Продать непроданные карточки пользователя одной транзакцией.
+
+        Без card_ids/id_ranges продаются все карточки (с учётом rarity),
+        иначе - только указанные id и диапазоны (от, до) включительно.
+        """
+        conditions = ['user_id = ?', 'is_sold = 0']
+        params = [user_id]
+        if rarity is not None:
+            conditions.append('card_id IN (SELECT id FROM cards WHERE rarity = ?)')
+            params.append(rarity)
+
+        id_filters = []
+        if card_ids:
+            id_filters.append(f"id IN ({', '.join('?' * len(card_ids))})")
+            params.extend(card_ids)
+        for first, last in id_ranges:
+            id_filters.append('id BETWEEN ? AND ?')
+            params.extend((first, last))
+        if id_filters:
+            conditions.append(f"({' OR '.join(id_filters)})")
+
+        with self.transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE user_cards 
+                SET is_sold = 1, sold_at = ? 
+                WHERE {' AND '.join(conditions)}
+                RETURNING id, card_id
+            ''', [datetime.now()] + params)
+            sold = cursor.fetchall()
+            total_price = sum(prices.get(self.get_card_rarity(row['card_id']), 0) for row in sold)
+
+            if not sold:
+                cursor.execute(f'SELECT {USER_ROW} FROM users WHERE user_id = ?', (user_id,))
+                user = cursor.fetchone()
+            else:
+                # Одна запись журнала на продажу; ref - id первой проданной карточки,
+                # остальные карточки продажи - с тем же sold_at у того же пользователя
+                first_id = min(row['id'] for row in sold)
+                user = self._record(cursor, user_id, total_price, 'sell', first_id)
+
+        if not user:
+            return SellResult(len(sold), total_price, 0, 0)
+        if sold:
+            self._notify(user)
+        return SellResult(len(sold), total_price, user['balance'], user['card_count'])
+
+    def get_cards_page(self, user_id, limit, cursor=None, newer=False, grouped=False):
+        """Одна страница коллекции с keyset-пагинацией.
+
+        Обычный режим: новые карточки сначала, ключ (obtained_at, id), курсор -
+        id карточки пользователя. Сгруппированный: одинаковые карточки с
+        количеством, ключ и курсор - id карточки в каталоге.
+        newer=True листает назад, к началу коллекции.
+        """
+        backwards = cursor is not None and newer
+        params = [user_id]
+        where = ''
+
+        if grouped:
+            ascending = not backwards
+            if cursor is not None:
+                where = f"AND card_id {'>' if ascending else '<'} ?"
+                params.append(cursor)
+            order = 'ASC' if ascending else 'DESC'
+            select = f'''
+                SELECT g.card_id as id, c.name as card_name, c.rarity, g.count
+                FROM (
+                    SELECT card_id, COUNT(*) as count
+                    FROM user_cards
+                    WHERE user_id = ? AND is_sold = 0 {where}
+                    GROUP BY card_id
+                    ORDER BY card_id {order}
+                    LIMIT ?
+                ) g
+                JOIN cards c ON c.id = g.card_id
+                ORDER BY g.card_id {order}
+            '''
+        else:
+            ascending = backwards
+            if cursor is not None:
+                # Ключ курсора берётся из самой строки, даже если её уже продали
+                where = f'''AND (obtained_at, id) {'>' if ascending else '<'}
+                    (SELECT obtained_at, id FROM user_cards WHERE id = ? AND user_id = ?)'''
+                params += [cursor, user_id]
+            order = 'ASC' if ascending else 'DESC'
+            select = f'''
+                SELECT * FROM user_cards_full
+                WHERE user_id = ? AND is_sold = 0 {where}
+                ORDER BY obtained_at {order}, id {order}
+                LIMIT ?
+            '''
+        params.append(limit + 1)
+
+        with self.transaction() as conn:
+            rows = conn.execute(select, params).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            if backwards:
+                rows.reverse()
+                has_prev, has_next = more, True
+            else:
+                has_prev, has_next = cursor is not None, more
+
+            # Счётчики ведут триггеры user_cards - не больше строки на редкость
+            rarity_counts = {
+                row['rarity']: row['count'] for row in conn.execute('''
+                    SELECT rarity, count FROM user_rarity_counts
+                    WHERE user_id = ? AND count > 0
+                ''', (user_id,))
+            }
+        return CardsPage(rows, has_prev, has_next, rarity_counts)
+
+
+class GroupCommitWriter:
+    """Групповая фиксация изменений: несколько операций - одна транзакция.
+
+    Операции ставятся в очередь и выполняются отдельным потоком пачками:
+    пачка набирается, пока не пройдёт flush_interval секунд с первой
+    операции или не наберётся max_batch операций, и фиксируется одним
+    COMMIT - синхронизация с диском одна на всю пачку. Каждая операция
+    выполняется в своей точке сохранения: ошибка одной откатывает только
+    её. Future операции завершается после COMMIT, так что ответ означает,
+    что изменение записано. durability: "normal" (synchronous=NORMAL, как
+    у остальных соединений) или "full" (synchronous=FULL - сброс на диск
+    при каждой фиксации пачки).
+    """
+
+    SYNCHRONOUS = {'normal': 'NORMAL', 'full': 'FULL'}
+
+    def __init__(self, db, max_batch=64, flush_interval=0.005, durability='normal'):
+        if durability not in self.SYNCHRONOUS:
+            raise ValueError(f"Неизвестный режим надёжности записи: {durability}")
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.durability = durability
+        # (fn, args, kwargs, future) или None - сигнал остановки
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='db-group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, args=(), kwargs=None):
+        """Поставить fn(*args, **kwargs) в очередь; вернуть concurrent.futures.Future"""
+        future = Future()
+        self._queue.put((fn, args, kwargs or {}, future))
+        return future
+
+    def close(self):
+        """Дописать очередь и остановить поток"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        """Набрать пачку после первой операции; вернуть (пачка, пора ли остановиться)"""
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        conn = self.db.pool.acquire()
+        conn.execute(f'PRAGMA synchronous={self.SYNCHRONOUS[self.durability]}')
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch, stop = self._collect(item)
+                self._flush(conn, batch)
+                if stop:
+                    break
+        finally:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.db.pool.release(conn)
+
+    def _flush(self, conn, batch):
+        db = self.db
+        results = []
+        # Подписчики узнают об изменениях только после фиксации
+        notifications = []
+        db._local.conn = conn
+        db._local.deferred = notifications
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, args, kwargs, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                mark = len(notifications)
+                conn.execute('SAVEPOINT group_op')
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO group_op')
+                    conn.execute('RELEASE group_op')
+                    del notifications[mark:]
+                    db.invalidate_caches()
+                    results.append((future, None, e))
+                    continue
+                conn.execute('RELEASE group_op')
+                results.append((future, result, None))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            db.invalidate_caches()
+            logger.error(f"Ошибка фиксации пачки изменений ({len(batch)} шт.): {e}")
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            db._local.conn = None
+            db._local.deferred = None
+
+        for user in notifications:
+            db._notify(user)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database для обработчиков бота.
+
+    Запросы выполняются вне цикла событий: чтение - в пуле потоков,
+    все изменения - в одном потоке-писателе (или пачками через
+    GroupCommitWriter), поэтому медленная запись на диск не блокирует
+    обработку других обновлений. Чтение по пользователю (первый аргумент
+    - user_id) дожидается его ещё не зафиксированных изменений.
+    """
+
+    READ_METHODS = frozenset({
+        'get_user',
+        'get_charge_clocks',
+        'get_user_cards',
+        'get_top_players',
+        'get_photo_file_id',
+        'get_user_stats',
+        'get_cards_page',
+    })
+
+    def __init__(self, db, read_threads=3, group_commit=None):
+        self.sync = db
+        # GroupCommitWriter или None - тогда каждая запись фиксируется отдельно
+        self.group_commit = group_commit
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=read_threads,
+                                           thread_name_prefix='db-reader')
+        # user_id -> незавершённые записи пользователя
+        self._pending_writes = {}
+
+    @staticmethod
+    def _user_key(args):
+        return args[0] if args and isinstance(args[0], int) else None
+
+    async def _submit(self, executor, fn, args, kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+    async def _read(self, fn, args, kwargs):
+        pending = self._pending_writes.get(self._user_key(args))
+        if pending:
+            await asyncio.wait(list(pending))
+        return await self._submit(self._readers, fn, args, kwargs)
+
+    async def _write(self, fn, args, kwargs, user_key=None):
+        if self.group_commit is not None:
+            future = asyncio.wrap_future(self.group_commit.submit(fn, args, kwargs))
+        else:
+            future = asyncio.ensure_future(self._submit(self._writer, fn, args, kwargs))
+        if user_key is not None:
+            pending = self._pending_writes.setdefault(user_key, set())
+            pending.add(future)
+
+            def done(_):
+                pending.discard(future)
+                if not pending and self._pending_writes.get(user_key) is pending:
+                    del self._pending_writes[user_key]
+
+            future.add_done_callback(done)
+        return await future
+
+    def __getattr__(self, name):
+        method = getattr(self.sync, name)
+        if name in self.READ_METHODS:
+            async def call(*args, **kwargs):
+                return await self._read(method, args, kwargs)
+        else:
+            async def call(*args, **kwargs):
+                return await self._write(method, args, kwargs, self._user_key(args))
+
+        call.__name__ = name
+        return call
+
+    def close(self):
+        if self.group_commit is not None:
+            self.group_commit.close()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.sync.close()
@@ -0,0 +1,266 @@
+"""Выгрузка данных бота и проверка таблицы выпадения.
+
+Строки читаются порциями через fetchmany в одной транзакции чтения (WAL):
+память не зависит от размера таблиц, а бот может работать во время
+выгрузки. Проверка выпадения сравнивает число выпавших карточек каждой
+редкости с таблицей DROP_RATES (с учётом пустых папок, как в
+get_random_card) по критерию хи-квадрат за один проход по истории
+карточек (user_cards и архив проданных). Карточки выгружаются сначала
+текущие, затем архивные - каждые по возрастанию id.
+
+Пример:
+    python export.py users --format csv --out users.csv
+    python export.py cards --format jsonl --audit > cards.jsonl
+    python export.py ledger --db bot_database.db
+    python export.py audit --since 2024-06-01
+"""
+import csv
+import sys
+import json
+import math
+import logging
+import argparse
+from collections import Counter
+
+from config import Config
+from catalog import CardCatalog
+from database import Database, USER_ROW
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 10000
+
+# Набор данных - запросы, выгружаемые друг за другом. Каждый упорядочен по
+# первичному ключу своей таблицы: сортировка по общему id текущих и архивных
+# карточек собирала бы всю историю во временном B-дереве до первой строки
+CARD_COLUMNS = 'id, user_id, card_id, card_name, rarity, obtained_at, is_sold'
+
+QUERIES = {
+    'users': [f'''
+        SELECT {USER_ROW}, created_at FROM users
+        ORDER BY user_id
+    '''],
+    'cards': [f'''
+        SELECT {CARD_COLUMNS} FROM user_cards_full
+        WHERE ? IS NULL OR obtained_at >= ?
+        ORDER BY id
+    ''', '''
+        SELECT a.id, a.user_id, a.card_id, c.name AS card_name, c.rarity,
+               a.obtained_at, 1 AS is_sold
+        FROM user_cards_archive a
+        JOIN cards c ON c.id = a.card_id
+        WHERE ? IS NULL OR a.obtained_at >= ?
+        ORDER BY a.id
+    '''],
+    'ledger': ['''
+        SELECT id, user_id, amount, reason, ref, created_at FROM balance_ledger
+        ORDER BY id
+    '''],
+}
+
+# card_id всех выпавших карточек - текущих и архивных
+CARD_IDS = [
+    'SELECT card_id FROM user_cards WHERE ? IS NULL OR obtained_at >= ?',
+    'SELECT card_id FROM user_cards_archive WHERE ? IS NULL OR obtained_at >= ?',
+]
+
+
+def stream(cursor, chunk_size=CHUNK_SIZE):
+    """Строки курсора порциями по chunk_size"""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def stream_all(conn, queries, params, chunk_size=CHUNK_SIZE):
+    """Строки нескольких запросов подряд: (имена столбцов первого запроса, строки)"""
+    cursors = [conn.execute(sql, params) for sql in queries]
+    columns = [description[0] for description in cursors[0].description]
+
+    def rows():
+        for cursor in cursors:
+            yield from stream(cursor, chunk_size)
+
+    return columns, rows()
+
+
+def write_csv(out, columns, rows):
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(tuple(row))
+        count += 1
+    return count
+
+
+def write_jsonl(out, columns, rows):
+    count = 0
+    for row in rows:
+        out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        out.write('\n')
+        count += 1
+    return count
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
+
+
+def chi2_sf(statistic, dof):
+    """Вероятность получить хи-квадрат не меньше statistic при dof степенях свободы"""
+    if statistic <= 0:
+        return 1.0
+    a, x = dof / 2, statistic / 2
+    scale = math.exp(a * math.log(x) - x - math.lgamma(a))
+    if x < a + 1:
+        # Ряд для нижней неполной гамма-функции
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * scale)
+    # Цепная дробь для верхней неполной гамма-функции (метод Лентца)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    result = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = b + an / c
+        c = c if abs(c) > tiny else tiny
+        result *= d * c
+        if abs(d * c - 1) < 1e-15:
+            break
+    return result * scale
+
+
+class DropRateAudit:
+    """Наблюдаемые частоты редкостей против ожидаемых вероятностей"""
+
+    def __init__(self, expected):
+        # редкость -> вероятность (сумма 1)
+        self.expected = expected
+        self.counts = Counter()
+
+    def track(self, rows, column='rarity'):
+        """Пропустить строки дальше, посчитав редкости по пути"""
+        for row in rows:
+            self.counts[row[column]] += 1
+            yield row
+
+    def report(self):
+        """(строки [(редкость, выпало, ожидалось, вклад)], хи-квадрат, степени свободы, p)"""
+        total = sum(self.counts[rarity] for rarity in self.expected)
+        lines = []
+        statistic = 0.0
+        for rarity, probability in self.expected.items():
+            observed = self.counts[rarity]
+            expected = total * probability
+            contribution = (observed - expected) ** 2 / expected if expected else 0.0
+            statistic += contribution
+            lines.append((rarity, observed, expected, contribution))
+        dof = len(self.expected) - 1
+        p_value = chi2_sf(statistic, dof) if dof > 0 and total else 1.0
+        return lines, statistic, dof, p_value
+
+    def unknown(self):
+        """Выпавшие редкости, которых нет в текущей таблице выпадения"""
+        return {rarity: n for rarity, n in self.counts.items() if rarity not in self.expected}
+
+    def print_report(self, out):
+        lines, statistic, dof, p_value = self.report()
+        total = sum(observed for _, observed, _, _ in lines)
+        print(f"Карточек: {total}", file=out)
+        print(f"{'Редкость':<14}{'Выпало':>10}{'Доля':>9}{'Ожидалось':>12}{'Ожид. доля':>12}{'Вклад χ²':>11}",
+              file=out)
+        for rarity, observed, expected, contribution in lines:
+            share = observed / total if total else 0.0
+            print(f"{rarity:<14}{observed:>10}{share:>9.2%}{expected:>12.1f}"
+                  f"{self.expected[rarity]:>12.2%}{contribution:>11.2f}", file=out)
+        print(f"χ² = {statistic:.2f}, степеней свободы: {dof}, p = {p_value:.4g}", file=out)
+        for rarity, n in sorted(self.unknown().items()):
+            print(f"  редкость {rarity} не в таблице выпадения: {n} шт. (не учтены)", file=out)
+
+
+def expected_rates(config):
+    """Вероятности редкостей так, как их выбирает get_random_card"""
+    catalog = CardCatalog(config.CARDS_PATH, config.DROP_RATES, extensions=config.CARD_EXTENSIONS)
+    return catalog.expected_rates()
+
+
+def audit(database, expected, since=None):
+    """Подсчитать редкости за один проход по истории карточек.
+
+    GROUP BY сортировал бы все строки во временном B-дереве, поэтому
+    карточки считаются по card_id в памяти - по числу карточек в каталоге.
+    """
+    result = DropRateAudit(expected)
+    by_card = Counter()
+    with database.get_connection() as conn:
+        conn.execute('BEGIN')
+        _, rows = stream_all(conn, CARD_IDS, (since, since))
+        for row in rows:
+            by_card[row[0]] += 1
+        rarities = dict(conn.execute('SELECT id, rarity FROM cards').fetchall())
+    for card_id, count in by_card.items():
+        result.counts[rarities[card_id]] += count
+    return result
+
+
+def export(database, dataset, out, output_format='csv', since=None, drop_audit=None):
+    """Выгрузить набор данных в out; вернуть число строк"""
+    params = (since, since) if dataset == 'cards' else ()
+    with database.get_connection() as conn:
+        # Все порции читаются из одной версии БД
+        conn.execute('BEGIN')
+        columns, rows = stream_all(conn, QUERIES[dataset], params)
+        if drop_audit is not None:
+            rows = drop_audit.track(rows)
+        return WRITERS[output_format](out, columns, rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка данных и проверка выпадения карточек")
+    parser.add_argument('command', choices=('users', 'cards', 'ledger', 'audit'))
+    parser.add_argument('--db', default=Config.DB_PATH, help="файл базы данных")
+    parser.add_argument('--format', choices=sorted(WRITERS), default='csv', dest='output_format')
+    parser.add_argument('--out', help="файл для выгрузки (по умолчанию - стандартный вывод)")
+    parser.add_argument('--since', help="только карточки, полученные с этой даты (YYYY-MM-DD)")
+    parser.add_argument('--audit', action='store_true',
+                        help="при выгрузке cards проверить выпадение по тем же строкам")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    database = Database(args.db, pool_size=1)
+    try:
+        if args.command == 'audit':
+            audit(database, expected_rates(Config), args.since).print_report(sys.stdout)
+            return 0
+
+        drop_audit = None
+        if args.audit and args.command == 'cards':
+            drop_audit = DropRateAudit(expected_rates(Config))
+        out = open(args.out, 'w', encoding='utf-8', newline='') if args.out else sys.stdout
+        try:
+            count = export(database, args.command, out, args.output_format, args.since, drop_audit)
+        finally:
+            if args.out:
+                out.close()
+        print(f"Выгружено строк: {count}", file=sys.stderr)
+        if drop_audit is not None:
+            drop_audit.print_report(sys.stderr)
+        return 0
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Очереди по приоритету: меньшее значение отправляется раньше
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Результаты открытия ящика важнее обновления меню
+ENDPOINT_PRIORITIES = {
+    'sendPhoto': PRIORITY_HIGH,
+    'sendMediaGroup': PRIORITY_HIGH,
+    'editMessageText': PRIORITY_LOW,
+    'editMessageCaption': PRIORITY_LOW,
+    'editMessageReplyMarkup': PRIORITY_LOW,
+}
+
+# Правки, из которых достаточно отправить последнюю
+COALESCED_ENDPOINTS = ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup')
+
+
+class TokenBucket:
+    """Ведро токенов, в котором ждущие обслуживаются по приоритету"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        # До какого момента ведро закрыто после ответа 429
+        self._paused_until = 0.0
+        # (приоритет, порядковый номер, future)
+        self._waiters = []
+        self._counter = itertools.count()
+        self._drainer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    @property
+    def idle(self):
+        self._refill()
+        return not self._waiters and self._tokens >= self.capacity and not self._drainer
+
+    def pause(self, seconds):
+        """Не выдавать токены seconds секунд (после RetryAfter)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        now = self._refill()
+        if not self._waiters and self._tokens >= 1 and now >= self._paused_until:
+            self._tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._drainer is None:
+            self._drainer = asyncio.ensure_future(self._drain())
+        await future
+
+    async def _drain(self):
+        try:
+            while self._waiters:
+                now = self._refill()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                while self._waiters and self._tokens >= 1:
+                    _, _, future = heapq.heappop(self._waiters)
+                    if not future.done():
+                        self._tokens -= 1
+                        future.set_result(None)
+                if self._waiters:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+        finally:
+            self._drainer = None
+
+
+class _PendingEdit:
+    __slots__ = ('args', 'kwargs', 'future', 'started')
+
+    def __init__(self, args, kwargs, future):
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.started = False
+
+
+class FloodLimiter(BaseRateLimiter):
+    """Ограничение исходящих запросов под лимиты Telegram.
+
+    Отправки и правки сообщений проходят через общее ведро токенов и ведро
+    своего чата (для групп лимит ниже). Ждущие запросы обслуживаются по
+    приоритету: результаты открытия ящика раньше обновлений меню. Приоритет
+    берётся по методу API или из rate_limit_args={'priority': ...}. На
+    ответ 429 (RetryAfter) чат приостанавливается на указанное время и
+    запрос повторяется. Если правка сообщения ещё ждёт отправки, а для того
+    же сообщения пришла новая, отправляется только последняя - результат
+    получают оба вызова.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1.0, chat_burst=3, group_rate=20 / 60,
+                 group_burst=5, max_retries=3, max_idle_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_idle_chats = max_idle_chats
+        # chat_id -> TokenBucket
+        self._chats = {}
+        # (метод, чат, сообщение) -> _PendingEdit
+        self._edits = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _is_limited(endpoint):
+        return endpoint.startswith(('send', 'edit', 'copy', 'forward'))
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_idle_chats:
+                # Полные вёдра без ожидающих ничего не помнят - их можно выбросить
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.idle}
+            # У групп и каналов id отрицательные
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _send(self, callback, args, kwargs, chat_id, priority, on_acquired=None):
+        bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        for attempt in range(self.max_retries + 1):
+            if bucket is not None:
+                await bucket.acquire(priority)
+            await self.global_bucket.acquire(priority)
+            if on_acquired is not None:
+                args, kwargs = on_acquired()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Лимит Telegram для чата {chat_id}: пауза {exc.retry_after} с")
+                # Без чата (inline-сообщения) приостанавливаем все отправки
+                (bucket or self.global_bucket).pause(exc.retry_after)
+
+    async def _send_edit(self, key, callback, args, kwargs, chat_id, priority):
+        pending = self._edits.get(key)
+        if pending is not None and not pending.started:
+            # Более ранняя правка ещё не ушла - заменяем её содержимое
+            pending.args = args
+            pending.kwargs = kwargs
+            return await asyncio.shield(pending.future)
+
+        future = asyncio.get_running_loop().create_future()
+        # Исключение нужно только присоединившимся вызовам - не логируем его как забытое
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        pending = self._edits[key] = _PendingEdit(args, kwargs, future)
+
+        def take_latest():
+            # Дальше правку уже не подменить: новые пойдут следующим запросом
+            if self._edits.get(key) is pending:
+                del self._edits[key]
+            pending.started = True
+            return pending.args, pending.kwargs
+
+        try:
+            result = await self._send(callback, args, kwargs, chat_id, priority, take_latest)
+        except asyncio.CancelledError:
+            if self._edits.get(key) is pending:
+                del self._edits[key]
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        future.set_result(result)
+        return result
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not self._is_limited(endpoint):
+            return await callback(*args, **kwargs)
+
+        priority = ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_NORMAL)
+        if rate_limit_args and 'priority' in rate_limit_args:
+            priority = rate_limit_args['priority']
+        chat_id = data.get('chat_id')
+
+        if endpoint in COALESCED_ENDPOINTS:
+            key = (endpoint, chat_id, data.get('message_id'), data.get('inline_message_id'))
+            return await self._send_edit(key, callback, args, kwargs, chat_id, priority)
+        return await self._send(callback, args, kwargs, chat_id, priority)
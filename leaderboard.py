@@ -0,0 +1,115 @@
+import threading
+
+
+class Leaderboard:
+    """Топ игроков в памяти, обновляемый по мере изменений.
+
+    Хранятся только лучшие size + slack игроков, и любой игрок вне этого
+    набора заведомо не выше любого игрока внутри. Рост баланса или
+    коллекции обновляет набор на месте; если игрок из набора опустился ниже
+    остальных, он выбывает, а когда игроков становится меньше size, топ
+    помечается устаревшим и перестраивается из БД (см. needs_rebuild).
+    Пока топ устарел, изменения не применяются: слушатели вызываются после
+    фиксации, так что чтение из БД их застанет. Исключение - окно между
+    begin_rebuild() и load(): изменения, пришедшие во время чтения топа,
+    откладываются (последние значения каждого игрока) и применяются поверх
+    загруженного, иначе они бы потерялись.
+    """
+
+    def __init__(self, size=10, slack=10):
+        self.size = size
+        self.capacity = size + slack
+        # user_id -> (balance, card_count, username)
+        self._entries = {}
+        # Все игроки помещаются в набор - можно добавлять любого
+        self._complete = False
+        self._stale = True
+        self._ranking = None
+        # Идёт чтение топа из БД: изменения откладываются в _pending
+        self._rebuilding = False
+        # user_id -> (balance, card_count, username)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _score(entry):
+        return entry[0], entry[1]
+
+    @property
+    def needs_rebuild(self):
+        return self._stale
+
+    def invalidate(self):
+        """Пометить топ устаревшим: он перестроится из БД при следующем запросе"""
+        with self._lock:
+            self._stale = True
+
+    def begin_rebuild(self):
+        """Вызвать перед чтением топа из БД: изменения до load() не потеряются"""
+        with self._lock:
+            self._rebuilding = True
+
+    def load(self, rows):
+        """Заполнить топ из БД (строки get_top_players(capacity))"""
+        with self._lock:
+            self._entries = {
+                row['user_id']: (row['balance'], row['card_count'], row['username'])
+                for row in rows
+            }
+            self._complete = len(self._entries) < self.capacity
+            self._stale = False
+            self._ranking = None
+            self._rebuilding = False
+            pending, self._pending = self._pending, {}
+            for user_id, entry in pending.items():
+                self._apply(user_id, entry)
+
+    def _evict_weakest(self):
+        weakest = min(self._entries, key=lambda uid: self._score(self._entries[uid]))
+        del self._entries[weakest]
+
+    def observe(self, user_id, username, balance, card_count):
+        """Учесть новый баланс и число карточек игрока"""
+        with self._lock:
+            self._apply(user_id, (balance, card_count, username))
+
+    def _apply(self, user_id, entry):
+        if self._stale:
+            if self._rebuilding:
+                # Чтение топа из БД могло не застать это изменение - применим после load()
+                self._pending[user_id] = entry
+            return
+
+        score = self._score(entry)
+        old = self._entries.get(user_id)
+        if self._complete or (old is not None and score >= self._score(old)):
+            self._entries[user_id] = entry
+        else:
+            others = [self._score(e) for uid, e in self._entries.items() if uid != user_id]
+            if not others or score < min(others):
+                # Игроки вне набора могут оказаться выше - в набор не берём
+                if old is None:
+                    return
+                del self._entries[user_id]
+                if len(self._entries) < self.size:
+                    self._stale = True
+            else:
+                self._entries[user_id] = entry
+
+        if len(self._entries) > self.capacity:
+            self._complete = False
+            self._evict_weakest()
+        self._ranking = None
+
+    def top(self, limit=None):
+        """Лучшие игроки: список словарей как у get_top_players"""
+        with self._lock:
+            if self._ranking is None:
+                ranked = sorted(self._entries.items(),
+                                key=lambda item: self._score(item[1]), reverse=True)
+                self._ranking = [
+                    {'user_id': user_id, 'username': username,
+                     'balance': balance, 'card_count': card_count}
+                    for user_id, (balance, card_count, username) in ranked
+                ]
+            return self._ranking[:limit or self.size]
@@ -0,0 +1,103 @@
+"""Проверка и восстановление балансов по журналу balance_ledger.
+
+Журнал читается одним проходом по возрастанию id, балансы пересчитываются
+в памяти и сравниваются со снимком users.balance на последнюю
+контрольную точку. Чтение идёт в одной транзакции чтения (WAL), поэтому
+бот может работать во время проверки.
+
+Пример:
+    python ledger.py verify
+    python ledger.py rebuild --db bot_database.db
+"""
+import sys
+import logging
+import argparse
+from collections import defaultdict
+
+from config import Config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+def replay(conn, upto):
+    """Балансы по журналу до записи upto включительно: {user_id: сумма}"""
+    balances = defaultdict(int)
+    cursor = conn.execute('''
+        SELECT user_id, amount FROM balance_ledger
+        WHERE id <= ?
+        ORDER BY id
+    ''', (upto,))
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        for user_id, amount in rows:
+            balances[user_id] += amount
+    return balances
+
+
+def verify(database):
+    """Сравнить снимок балансов с журналом.
+
+    Возвращает (номер контрольной точки, расхождения [(user_id, в снимке,
+    по журналу)], записи журнала без пользователя {user_id: сумма}).
+    """
+    with database.get_connection() as conn:
+        # Снимок и журнал читаются из одной версии БД
+        conn.execute('BEGIN')
+        checkpoint = conn.execute('SELECT MAX(ledger_id) FROM ledger_checkpoints').fetchone()[0]
+        balances = replay(conn, checkpoint)
+        mismatches = []
+        for user_id, balance in conn.execute('SELECT user_id, balance FROM users ORDER BY user_id'):
+            expected = balances.pop(user_id, 0)
+            if balance != expected:
+                mismatches.append((user_id, balance, expected))
+    return checkpoint, mismatches, dict(balances)
+
+
+def rebuild(database):
+    """Переписать снимок балансов по журналу; вернуть число исправленных пользователей"""
+    with database.transaction(immediate=True) as conn:
+        checkpoint = conn.execute('SELECT MAX(ledger_id) FROM ledger_checkpoints').fetchone()[0]
+        balances = replay(conn, checkpoint)
+        cursor = conn.cursor()
+        fixed = 0
+        for user_id, balance in conn.execute('SELECT user_id, balance FROM users').fetchall():
+            expected = balances.get(user_id, 0)
+            if balance != expected:
+                cursor.execute('UPDATE users SET balance = ? WHERE user_id = ?', (expected, user_id))
+                fixed += 1
+    return fixed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка балансов по журналу")
+    parser.add_argument('command', choices=('verify', 'rebuild'))
+    parser.add_argument('--db', default=Config.DB_PATH, help="файл базы данных")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    database = Database(args.db, pool_size=1)
+    try:
+        if args.command == 'rebuild':
+            print(f"Исправлено балансов: {rebuild(database)}")
+            return 0
+
+        checkpoint, mismatches, orphans = verify(database)
+        print(f"Контрольная точка: запись журнала {checkpoint}")
+        for user_id, balance, expected in mismatches:
+            print(f"  пользователь {user_id}: в снимке {balance}, по журналу {expected}")
+        for user_id, total in sorted(orphans.items()):
+            print(f"  записи журнала без пользователя {user_id}: {total}")
+        if mismatches or orphans:
+            print(f"Расхождений: {len(mismatches)}, лишних пользователей в журнале: {len(orphans)}")
+            return 1
+        print("Балансы совпадают с журналом")
+        return 0
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,33 @@
 
-import os
-import random
+import signal
+import asyncio
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest, TelegramError
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler,
-    MessageHandler, filters, ContextTypes
+    Application, ApplicationHandlerStop, CommandHandler, CallbackQueryHandler,
+    ChatMemberHandler, MessageHandler, filters, ContextTypes
 )
 
 from config import Config
-from database import Database
+from database import Database, AsyncDatabase, GroupCommitWriter
+from catalog import CardCatalog
+from subscription import SubscriptionCache, MEMBER_STATUSES
+from leaderboard import Leaderboard
+from cooldowns import CooldownService
+from callback_guard import CallbackGuard, ACCEPTED, DUPLICATE
+from photo_cache import PhotoCache
+from assets import AssetPipeline
+from metrics import BotMetrics, InstrumentedRequest, MetricsServer
+from webhook import WebhookServer
+from update_processor import PerUserUpdateProcessor
+from flood_limiter import FloodLimiter
+from supervisor import Supervisor, shard_of
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,14 +36,152 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация базы данных
-db = Database()
-
 
 class CardBot:
-    def __init__(self):
+    def __init__(self, database: Database = None, request: BaseRequest = None, shard: tuple = None):
         self.config = Config()
-        self.app = Application.builder().token(self.config.TOKEN).build()
+        # (номер, число) рабочих процессов в многопроцессном режиме (см. supervisor.py)
+        self.shard = shard
+        if database is None:
+            database = Database(self.config.DB_PATH, pool_size=self.config.DB_POOL_SIZE)
+        self.metrics = None
+        self.metrics_server = None
+        if self.config.METRICS_ENABLED:
+            # Замеры включаются обёртками, поэтому без метрик код не меняется
+            self.metrics = BotMetrics(slow_query_ms=self.config.SLOW_QUERY_MS)
+            self.metrics.instrument_database(database)
+            if request is None:
+                # Тот же размер пула, что выбирает ApplicationBuilder по умолчанию
+                request = HTTPXRequest(connection_pool_size=256)
+            request = InstrumentedRequest(request, self.metrics)
+            self.metrics_server = MetricsServer(
+                self.metrics, host=self.config.METRICS_HOST, port=self.config.METRICS_PORT
+            )
+        # Все обращения к БД из обработчиков идут через потоки, не блокируя цикл событий
+        group_commit = None
+        if self.config.DB_GROUP_COMMIT:
+            group_commit = GroupCommitWriter(
+                database,
+                max_batch=self.config.DB_GROUP_COMMIT_MAX_BATCH,
+                flush_interval=self.config.DB_GROUP_COMMIT_INTERVAL_MS / 1000,
+                durability=self.config.DB_DURABILITY
+            )
+        self.db = AsyncDatabase(database, read_threads=self.config.DB_READ_THREADS,
+                                group_commit=group_commit)
+        self.photo_cache = PhotoCache(self.db)
+        self.catalog = CardCatalog(
+            self.config.CARDS_PATH,
+            self.config.DROP_RATES,
+            extensions=self.config.CARD_EXTENSIONS,
+            reload_interval=self.config.CATALOG_RELOAD_INTERVAL
+        )
+        self.assets = AssetPipeline(
+            self.config.ASSETS_CACHE_PATH,
+            max_side=self.config.ASSET_MAX_SIDE,
+            quality=self.config.ASSET_QUALITY,
+            image_format=self.config.ASSET_FORMAT,
+            workers=self.config.ASSET_WORKERS
+        )
+        # Снимок каталога, для которого собраны изображения
+        self._assets_snapshot = None
+        if self.config.ASSETS_ENABLED:
+            self.build_assets()
+        self.subscriptions = SubscriptionCache(
+            self.fetch_subscription,
+            positive_ttl=self.config.SUBSCRIPTION_POSITIVE_TTL,
+            negative_ttl=self.config.SUBSCRIPTION_NEGATIVE_TTL,
+            max_size=self.config.SUBSCRIPTION_CACHE_SIZE
+        )
+        # Топ игроков в памяти: строится при запуске и обновляется при каждой записи
+        self.leaderboard = Leaderboard(size=10, slack=self.config.LEADERBOARD_SLACK)
+        # Топ строится по снимку балансов - сначала переносим в него журнал
+        database.checkpoint_ledger()
+        self.leaderboard.load(database.get_top_players(self.leaderboard.capacity))
+        database.user_listeners.append(self.leaderboard.observe)
+        # Заряды в памяти: загружаются игроки, у которых заряды ещё копятся
+        self.cooldowns = CooldownService(
+            self.config.COOLDOWN_SECONDS,
+            self.config.MAX_CHARGES,
+            tick=self.config.READY_TICK_SECONDS,
+            timers=self.config.READY_NOTIFICATIONS
+        )
+        full_since = datetime.now() - timedelta(
+            seconds=self.config.COOLDOWN_SECONDS * self.config.MAX_CHARGES
+        )
+        clocks = database.get_charge_clocks(full_since)
+        if shard is not None:
+            # Таймеры остальных игроков ведут процессы, которым те закреплены
+            index, workers = shard
+            clocks = [row for row in clocks if shard_of(row[0], workers) == index]
+        self.cooldowns.load(clocks)
+        # Допуск нажатий на кнопки и содержимое последних правок сообщений
+        self.callback_guard = CallbackGuard(
+            window=self.config.CALLBACK_DEBOUNCE_SECONDS,
+            rate=self.config.CALLBACK_RATE,
+            burst=self.config.CALLBACK_BURST,
+            max_size=self.config.CALLBACK_GUARD_SIZE
+        )
+        # (chat_id, message_id) -> хэш текста и кнопок
+        self._sent_edits = OrderedDict()
+        builder = (
+            Application.builder()
+            .token(self.config.TOKEN)
+            .concurrent_updates(PerUserUpdateProcessor(self.config.CONCURRENT_UPDATES))
+            .post_shutdown(self.on_shutdown)
+        )
+        if self.config.FLOOD_LIMIT_ENABLED:
+            builder = builder.rate_limiter(FloodLimiter(
+                global_rate=self.config.FLOOD_GLOBAL_RATE,
+                chat_rate=self.config.FLOOD_CHAT_RATE,
+                chat_burst=self.config.FLOOD_CHAT_BURST,
+                group_rate=self.config.FLOOD_GROUP_PER_MINUTE / 60,
+                max_retries=self.config.FLOOD_MAX_RETRIES
+            ))
+        if request is not None:
+            # Свой HTTP-клиент для Bot API (например, заглушка в benchmark.py)
+            builder = builder.request(request)
+        self.app = builder.build()
+        # Обслуживание общей БД в многопроцессном режиме выполняет только первый процесс
+        maintenance = shard is None or shard[0] == 0
+        if maintenance and self.app.job_queue is None:
+            logger.warning("JobQueue недоступен - контрольные точки журнала баланса только при запуске")
+        elif maintenance:
+            self.app.job_queue.run_repeating(
+                self.checkpoint_ledger,
+                interval=self.config.LEDGER_CHECKPOINT_SECONDS,
+                first=self.config.LEDGER_CHECKPOINT_SECONDS,
+                name="ledger_checkpoint"
+            )
+        if self.config.ARCHIVE_ENABLED and maintenance:
+            if self.app.job_queue is None:
+                logger.warning("JobQueue недоступен - архивация проданных карточек отключена")
+            else:
+                self.app.job_queue.run_repeating(
+                    self.archive_sold_cards,
+                    interval=self.config.ARCHIVE_INTERVAL_SECONDS,
+                    first=self.config.ARCHIVE_INTERVAL_SECONDS,
+                    name="archive_sold_cards"
+                )
+        if self.app.job_queue is None:
+            logger.warning("JobQueue недоступен - игроки с полными зарядами не удаляются из памяти")
+        else:
+            self.app.job_queue.run_repeating(
+                self.prune_cooldowns,
+                interval=self.config.COOLDOWN_PRUNE_SECONDS,
+                first=self.config.COOLDOWN_PRUNE_SECONDS,
+                name="cooldown_prune"
+            )
+        if self.config.READY_NOTIFICATIONS:
+            if self.app.job_queue is None:
+                logger.warning("JobQueue недоступен - уведомления о готовых ящиках отключены")
+            else:
+                # Одна задача на всех: проверяет колесо таймеров раз в тик
+                self.app.job_queue.run_repeating(
+                    self.notify_ready,
+                    interval=self.config.READY_TICK_SECONDS,
+                    first=self.config.READY_TICK_SECONDS,
+                    name="box_ready"
+                )
 
         # Регистрация обработчиков
         self.app.add_handler(CommandHandler("start", self.start))
@@ -34,26 +189,48 @@ class CardBot:
         self.app.add_handler(CommandHandler("sell", self.sell_card_command))
         self.app.add_handler(CommandHandler("help", self.help_command))
         self.app.add_handler(CallbackQueryHandler(self.button_handler))
+        if self.config.CALLBACK_GUARD_ENABLED:
+            # Группа -1 отсеивает повторные и слишком частые нажатия до button_handler,
+            # группа 1 отмечает конец обработки
+            self.app.add_handler(CallbackQueryHandler(self.admit_callback), group=-1)
+            self.app.add_handler(CallbackQueryHandler(self.finish_callback), group=1)
+        # Изменения подписчиков канала (приходят, если бот - администратор канала)
+        self.app.add_handler(ChatMemberHandler(self.on_chat_member, ChatMemberHandler.CHAT_MEMBER))
+        if self.metrics is not None:
+            self.metrics.instrument_handlers(self.app)
 
         # Запуск бота
         logger.info("Бот запущен!")
 
-    async def check_subscription(self, user_id: int) -> bool:
+    async def fetch_subscription(self, user_id: int) -> bool:
+        """Запрос статуса подписки у Telegram"""
+        member = await self.app.bot.get_chat_member(
+            chat_id=self.config.CHANNEL_ID,
+            user_id=user_id
+        )
+        return member.status in MEMBER_STATUSES
+
+    async def check_subscription(self, user_id: int, fresh: bool = False) -> bool:
         """Проверка подписки на канал"""
         try:
-            member = await self.app.bot.get_chat_member(
-                chat_id=self.config.CHANNEL_ID,
-                user_id=user_id
-            )
-            return member.status in ['member', 'administrator', 'creator']
+            return await self.subscriptions.is_subscribed(user_id, fresh=fresh)
         except Exception as e:
             logger.error(f"Ошибка при проверке подписки: {e}")
             return False
 
+    async def on_chat_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обновление кэша подписки при вступлении/выходе из канала"""
+        member_update = update.chat_member
+        if member_update.chat.id != self.config.CHANNEL_ID:
+            return
+
+        member = member_update.new_chat_member
+        self.subscriptions.set(member.user.id, member.status in MEMBER_STATUSES)
+
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user = update.effective_user
-        db.add_user(user.id, user.username)
+        await self.db.add_user(user.id, user.username)
 
         # Проверка подписки
         if not await self.check_subscription(user.id):
@@ -85,38 +262,45 @@ class CardBot:
                              message_id: int = None):
         """Показать главное меню"""
         user = update.effective_user
-        user_data = db.get_user(user.id)
+        user_data, card_count = await self.db.get_user_stats(user.id)
+        charges, next_charge_in = self.cooldowns.charges(user.id)
 
         keyboard = [
-            [InlineKeyboardButton("🎁 Открыть ящик", callback_data="open_box")],
+            [InlineKeyboardButton(f"🎁 Открыть ящик ({charges}/{self.config.MAX_CHARGES})",
+                                  callback_data="open_box")],
             [InlineKeyboardButton("🃏 Мои карточки", callback_data="my_cards")],
             [InlineKeyboardButton("🏆 Топ 10", callback_data="top_players")],
             [InlineKeyboardButton("💰 Баланс", callback_data="show_balance")]
         ]
+        if charges > 1:
+            opened = min(charges, self.config.OPEN_ALL_LIMIT)
+            keyboard.insert(1, [InlineKeyboardButton(f"🎁 Открыть все ({opened})",
+                                                     callback_data="open_all")])
         reply_markup = InlineKeyboardMarkup(keyboard)
+        if next_charge_in:
+            next_charge = f"⏳ Следующий ящик через {int(next_charge_in // 60)} мин\n"
+        else:
+            next_charge = ""
 
         text = (
             f"🎮 Добро пожаловать, {user.first_name}!\n\n"
             f"💰 Баланс: {user_data['balance'] if user_data else 0} тенге\n"
-            f"🃏 Карточек в коллекции: {db.get_card_count(user.id)}\n\n"
+            f"🃏 Карточек в коллекции: {card_count}\n"
+            f"{next_charge}\n"
             "Выберите действие:"
         )
 
         if message_id:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=message_id,
-                text=text,
-                reply_markup=reply_markup
-            )
+            await self.edit_message(context.bot, update.effective_chat.id, message_id,
+                                    text, reply_markup)
         else:
             if update.callback_query:
                 await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
             else:
                 await update.message.reply_text(text, reply_markup=reply_markup)
 
-    async def open_box(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Открытие ящика с карточкой"""
+    async def open_box(self, update: Update, context: ContextTypes.DEFAULT_TYPE, count: int = 1):
+        """Открытие ящиков: одного или сразу нескольких накопленных"""
         query = update.callback_query
         await query.answer()
 
@@ -127,75 +311,187 @@ class CardBot:
             await query.message.reply_text("❌ Вы отписались от канала! Подпишитесь снова.")
             return
 
-        # Проверка времени
-        if not db.can_open_box(user_id):
-            user_data = db.get_user(user_id)
-            last_opened = datetime.fromisoformat(user_data['last_opened'])
-            next_time = last_opened + timedelta(hours=1)
-            time_left = next_time - datetime.now()
-
-            minutes = int(time_left.total_seconds() // 60)
-            seconds = int(time_left.total_seconds() % 60)
-
-            await query.message.reply_text(
-                f"⏳ Следующее открытие через: {minutes} мин {seconds} сек"
-            )
+        # Заряды проверяются в памяти - пустое нажатие не обращается к БД
+        charges, next_charge_in = self.cooldowns.charges(user_id)
+        if charges == 0:
+            await query.message.reply_text(self.cooldown_text(next_charge_in))
             return
 
-        # Получение случайной карточки
-        card_info = self.get_random_card()
-        if not card_info:
+        # Получение случайных карточек (лишние не выдаются, если зарядов меньше)
+        cards = [self.get_random_card() for _ in range(count)]
+        if not all(cards):
             await query.message.reply_text("❌ Ошибка: карточки не найдены!")
             return
 
-        # Сохранение карточки в БД
-        db.add_card(user_id, card_info['name'], card_info['rarity'], card_info['path'])
-        db.update_last_opened(user_id)
-
-        # Отправка карточки
-        with open(card_info['path'], 'rb') as photo:
-            await query.message.reply_photo(
-                photo=photo,
-                caption=(
-                    f"🎉 Вы получили карточку!\n\n"
-                    f"🏷 Название: {card_info['name']}\n"
-                    f"⭐ Редкость: {card_info['rarity']}\n"
-                    f"💰 Цена продажи: {self.config.PRICES[card_info['rarity']]} тенге\n\n"
-                    f"ID карточки: {db.get_user_cards(user_id)[0]['id']}"
-                )
-            )
+        # Списание зарядов и сохранение карточек в БД
+        result = await self.db.open_boxes_atomic(
+            user_id, cards, self.config.COOLDOWN_SECONDS, self.config.MAX_CHARGES
+        )
+        self.cooldowns.update(user_id, result.charges_from)
+        if not result.card_ids:
+            await query.message.reply_text(self.cooldown_text(result.next_charge_in))
+            return
+
+        # Отправка карточек: одна - фото, несколько - одним альбомом
+        opened = list(zip(cards, result.card_ids))
+        if len(opened) == 1:
+            card, card_id = opened[0]
+            await self.send_card_photo(query.message, card.path,
+                                       caption=self.card_caption(card, card_id))
+        else:
+            await self.send_card_album(query.message, opened)
 
         await self.show_main_menu(update, context, query.message.message_id)
 
-    def get_random_card(self):
-        """Получение случайной карточки из папок"""
+    async def checkpoint_ledger(self, context: ContextTypes.DEFAULT_TYPE):
+        """Перенести журнал баланса в снимок users.balance (задача JobQueue)"""
         try:
-            # Веса для разных редкостей (можно настроить)
-            rarities = ["Обычный", "Редкий", "Легендарный", "Мифик", "Секрет"]
-            weights = [40, 30, 15, 10, 5]  # в процентах
-
-            chosen_rarity = random.choices(rarities, weights=weights, k=1)[0]
-            rarity_path = os.path.join(self.config.CARDS_PATH, chosen_rarity)
-
-            # Получение всех карточек в папке
-            cards = [f for f in os.listdir(rarity_path)
-                     if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))]
+            folded = await self.db.checkpoint_ledger()
+        except Exception as e:
+            logger.error(f"Ошибка контрольной точки журнала баланса: {e}")
+            return
+        if folded:
+            logger.info(f"Контрольная точка журнала баланса: {folded} записей")
+
+    async def archive_sold_cards(self, context: ContextTypes.DEFAULT_TYPE):
+        """Перенести старые проданные карточки в архив и вернуть место (задача JobQueue)"""
+        sold_before = datetime.now() - timedelta(days=self.config.ARCHIVE_AFTER_DAYS)
+        batch_size = self.config.ARCHIVE_BATCH_SIZE
+        moved = 0
+        try:
+            # Пачки - отдельные транзакции: между ними проходят записи обработчиков
+            while moved < self.config.ARCHIVE_MAX_PER_RUN:
+                batch = await self.db.archive_sold_cards(sold_before, batch_size)
+                moved += batch
+                if batch < batch_size:
+                    break
+            if not moved:
+                return
+            logger.info(f"В архив перенесено проданных карточек: {moved}")
+            # Не через поток записи: освобождение страниц не связано с пользователями
+            while True:
+                free = await asyncio.to_thread(self.db.sync.incremental_vacuum,
+                                               self.config.VACUUM_STEP_PAGES)
+                if not free:
+                    break
+        except Exception as e:
+            logger.error(f"Ошибка архивации проданных карточек: {e}")
+            return
+        if free is None:
+            logger.info("auto_vacuum выключен - место в файле БД переиспользуется, но не "
+                        "возвращается (включить: python archive.py vacuum при остановленном боте)")
+
+    @staticmethod
+    def cooldown_text(next_charge_in: float):
+        minutes = int(next_charge_in // 60)
+        seconds = int(next_charge_in % 60)
+        return f"⏳ Следующее открытие через: {minutes} мин {seconds} сек"
+
+    async def prune_cooldowns(self, context: ContextTypes.DEFAULT_TYPE):
+        """Забыть игроков, у которых накопились все заряды (задача JobQueue)"""
+        pruned = self.cooldowns.prune()
+        if pruned:
+            logger.debug(f"Игроков с полными зарядами удалено из памяти: {pruned}")
+
+    async def notify_ready(self, context: ContextTypes.DEFAULT_TYPE):
+        """Уведомить игроков, у которых накопился ящик (задача JobQueue)"""
+        for user_id in self.cooldowns.pop_due():
+            # Отправки идут в фоне: при большом числе игроков задача не затягивается
+            context.application.create_task(self.send_ready_notification(context.bot, user_id))
+
+    async def send_ready_notification(self, bot, user_id: int):
+        keyboard = [[InlineKeyboardButton("🎁 Открыть ящик", callback_data="open_box")]]
+        try:
+            await bot.send_message(user_id, "🎁 Ящик готов к открытию!",
+                                   reply_markup=InlineKeyboardMarkup(keyboard))
+        except TelegramError as e:
+            # Например, пользователь заблокировал бота
+            logger.debug(f"Уведомление для {user_id} не отправлено: {e}")
+
+    def card_caption(self, card, card_id: int):
+        return (
+            f"🎉 Вы получили карточку!\n\n"
+            f"🏷 Название: {card.name}\n"
+            f"⭐ Редкость: {card.rarity}\n"
+            f"💰 Цена продажи: {self.config.PRICES[card.rarity]} тенге\n\n"
+            f"ID карточки: {card_id}"
+        )
 
-            if not cards:
-                return None
+    async def send_card_photo(self, message, path: str, caption: str):
+        """Отправка изображения карточки с повторным использованием file_id"""
+        file_id = await self.photo_cache.get_file_id(path)
+        if file_id:
+            try:
+                return await message.reply_photo(photo=file_id, caption=caption)
+            except BadRequest as e:
+                logger.warning(f"file_id для {path} отклонён, загружаем заново: {e}")
+                await self.photo_cache.forget(path)
+
+        # Загружаем уменьшенную копию, если она готова; file_id запоминается для исходного пути
+        with open(self.assets.resolve(path), 'rb') as photo:
+            sent = await message.reply_photo(photo=photo, caption=caption)
+        await self.photo_cache.remember(path, sent.photo[-1].file_id)
+        return sent
+
+    async def send_card_album(self, message, opened):
+        """Отправка нескольких карточек одним альбомом (до 10 штук)"""
+        file_ids = [await self.photo_cache.get_file_id(card.path) for card, _ in opened]
+
+        def build_media(use_cached):
+            media = []
+            for (card, card_id), file_id in zip(opened, file_ids):
+                caption = self.card_caption(card, card_id)
+                if file_id and use_cached:
+                    media.append(InputMediaPhoto(file_id, caption=caption))
+                else:
+                    # Содержимое файла читается сразу при создании InputMediaPhoto
+                    with open(self.assets.resolve(card.path), 'rb') as photo:
+                        media.append(InputMediaPhoto(photo, caption=caption))
+            return media
 
-            chosen_card = random.choice(cards)
-            card_path = os.path.join(rarity_path, chosen_card)
-            card_name = os.path.splitext(chosen_card)[0]
+        use_cached = True
+        try:
+            sent = await message.reply_media_group(media=build_media(use_cached))
+        except BadRequest as e:
+            if not any(file_ids):
+                raise
+            logger.warning(f"file_id в альбоме отклонён, загружаем заново: {e}")
+            for (card, _), file_id in zip(opened, file_ids):
+                if file_id:
+                    await self.photo_cache.forget(card.path)
+            use_cached = False
+            sent = await message.reply_media_group(media=build_media(use_cached))
+
+        for (card, _), file_id, sent_message in zip(opened, file_ids, sent):
+            if not (file_id and use_cached) and sent_message.photo:
+                await self.photo_cache.remember(card.path, sent_message.photo[-1].file_id)
+        return sent
+
+    def build_assets(self):
+        """Обработать изображения текущего снимка каталога"""
+        snapshot = self.catalog.snapshot
+        paths = [card.path for cards in snapshot.cards.values() for card in cards]
+        try:
+            self.assets.build(paths)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке изображений карточек: {e}")
+            return
+        self._assets_snapshot = snapshot
 
-            return {
-                'name': card_name,
-                'rarity': chosen_rarity,
-                'path': card_path
-            }
+    def get_random_card(self):
+        """Получение случайной карточки из каталога"""
+        try:
+            card = self.catalog.random_card()
         except Exception as e:
             logger.error(f"Ошибка при получении карточки: {e}")
             return None
+        if (self.config.ASSETS_ENABLED and self.assets.enabled
+                and self.catalog.snapshot is not self._assets_snapshot):
+            # Каталог перечитан - новые картинки обрабатываются в фоне,
+            # а до готовности отправляются исходные файлы
+            self._assets_snapshot = self.catalog.snapshot
+            threading.Thread(target=self.build_assets, name='asset-build', daemon=True).start()
+        return card
 
     async def show_cards_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /cards"""
@@ -203,25 +499,57 @@ class CardBot:
         await self.show_cards(user.id, update.message.chat.id, context)
 
     async def show_cards(self, user_id: int, chat_id: int, context: ContextTypes.DEFAULT_TYPE,
-                         message_id: int = None):
-        """Показать карточки пользователя"""
-        cards = db.get_user_cards(user_id)
-
-        if not cards:
+                         message_id: int = None, grouped: bool = False,
+                         cursor: int = None, newer: bool = False):
+        """Показать страницу карточек пользователя"""
+        page_size = self.config.CARDS_GROUPED_PAGE_SIZE if grouped else self.config.CARDS_PAGE_SIZE
+        page = await self.db.get_cards_page(user_id, page_size, cursor=cursor,
+                                            newer=newer, grouped=grouped)
+
+        if not page.rows and cursor is not None:
+            # Курсор устарел (например, карточки продали) - начинаем сначала
+            page = await self.db.get_cards_page(user_id, page_size, grouped=grouped)
+
+        if not page.rows:
             text = "📭 У вас пока нет карточек!"
             keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]]
         else:
-            text = "🃏 Ваши карточки:\n\n"
-            for i, card in enumerate(cards, 1):
+            mode = "g" if grouped else "l"
+            text = f"🃏 Ваши карточки ({sum(page.rarity_counts.values())} шт.):\n\n"
+            for card in page.rows:
                 price = self.config.PRICES.get(card['rarity'], 0)
-                text += f"{i}. {card['card_name']}\n"
-                text += f"   ⭐ Редкость: {card['rarity']}\n"
-                text += f"   💰 Цена: {price} тенге\n"
-                text += f"   🆔 ID: {card['id']}\n\n"
+                if grouped:
+                    text += f"• {card['card_name']} × {card['count']}\n"
+                    text += f"   ⭐ {card['rarity']} · 💰 {price} тенге\n\n"
+                else:
+                    text += f"• {card['card_name']}\n"
+                    text += f"   ⭐ Редкость: {card['rarity']}\n"
+                    text += f"   💰 Цена: {price} тенге\n"
+                    text += f"   🆔 ID: {card['id']}\n\n"
 
             text += "\nДля продажи карточки используйте команду: /sell <id>"
 
-            keyboard = [
+            navigation = []
+            if page.has_prev:
+                navigation.append(InlineKeyboardButton(
+                    "◀️", callback_data=f"cards:{mode}:p:{page.rows[0]['id']}"))
+            if page.has_next:
+                navigation.append(InlineKeyboardButton(
+                    "▶️", callback_data=f"cards:{mode}:n:{page.rows[-1]['id']}"))
+            keyboard = [navigation] if navigation else []
+
+            if grouped:
+                keyboard.append([InlineKeyboardButton("📋 Списком", callback_data="cards:l")])
+            else:
+                keyboard.append([InlineKeyboardButton("📚 Сгруппировать", callback_data="cards:g")])
+
+            # Кнопки продажи по редкостям, которые есть в коллекции
+            keyboard += [
+                [InlineKeyboardButton(f"💰 Продать все: {rarity}",
+                                      callback_data=f"sell_rarity:{rarity}")]
+                for rarity in self.config.PRICES if rarity in page.rarity_counts
+            ]
+            keyboard += [
                 [InlineKeyboardButton("💰 Продать все", callback_data="sell_all")],
                 [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
             ]
@@ -229,12 +557,7 @@ class CardBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         if message_id:
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=text,
-                reply_markup=reply_markup
-            )
+            await self.edit_message(context.bot, chat_id, message_id, text, reply_markup)
         else:
             await context.bot.send_message(
                 chat_id=chat_id,
@@ -242,45 +565,111 @@ class CardBot:
                 reply_markup=reply_markup
             )
 
+    def parse_sell_args(self, args):
+        """Разбор аргументов /sell: id, диапазоны "10-15", редкость или "all"
+
+        Возвращает (card_ids, id_ranges, rarity); пустые card_ids и id_ranges
+        означают продажу всех карточек. ValueError - с текстом для пользователя.
+        """
+        if len(args) > self.config.SELL_MAX_ARGS:
+            raise ValueError(f"Можно указать не больше {self.config.SELL_MAX_ARGS} аргументов")
+
+        card_ids = []
+        id_ranges = []
+        rarity = None
+        sell_all = False
+        rarities = {name.lower(): name for name in self.config.PRICES}
+
+        for token in ' '.join(args).replace(',', ' ').split():
+            if token.lower() in ('all', 'все'):
+                sell_all = True
+            elif token.lower() in rarities:
+                rarity = rarities[token.lower()]
+            elif '-' in token:
+                first, _, last = token.partition('-')
+                if not (first.isdecimal() and last.isdecimal()):
+                    raise ValueError(f"Неверный диапазон «{token}»: нужны два ID через дефис, "
+                                     f"например 10-15")
+                first, last = self._card_id(first), self._card_id(last)
+                id_ranges.append((min(first, last), max(first, last)))
+            elif token.isdecimal():
+                card_ids.append(self._card_id(token))
+            else:
+                raise ValueError(f"«{token}» - не ID карточки и не редкость. "
+                                 f"Редкости: {', '.join(self.config.PRICES)}")
+
+        if not (card_ids or id_ranges or rarity or sell_all):
+            raise ValueError("Не указано, что продавать")
+        return card_ids, id_ranges, rarity
+
+    @staticmethod
+    def _card_id(token):
+        card_id = int(token)
+        # INTEGER в SQLite - 64 бита со знаком
+        if not 0 < card_id < 2 ** 63:
+            raise ValueError(f"Карточки с ID {token} не бывает")
+        return card_id
+
     async def sell_card_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Продажа карточки по ID"""
+        """Продажа карточек по ID, диапазонам ID или редкости"""
         if not context.args:
-            await update.message.reply_text("Использование: /sell <id_карточки>")
+            await update.message.reply_text(
+                "Использование: /sell <id_карточки>\n"
+                "Можно указать несколько id и диапазоны: /sell 12 15 20-25\n"
+                "Продать всё одной редкости: /sell Обычный\n"
+                "Продать все карточки: /sell all"
+            )
             return
 
         try:
-            card_id = int(context.args[0])
-            user_id = update.effective_user.id
+            card_ids, id_ranges, rarity = self.parse_sell_args(context.args)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
 
-            # Продажа карточки
-            rarity = db.sell_card(card_id, user_id)
+        try:
+            user_id = update.effective_user.id
 
-            if rarity:
-                price = self.config.PRICES[rarity]
-                db.update_balance(user_id, price)
-                user_data = db.get_user(user_id)
+            # Продажа карточек
+            result = await self.db.sell_cards(
+                user_id, self.config.PRICES,
+                card_ids=card_ids, id_ranges=id_ranges, rarity=rarity
+            )
 
+            if not result.sold_count:
+                await update.message.reply_text("❌ Карточка не найдена или уже продана!")
+            elif result.sold_count == 1:
                 await update.message.reply_text(
-                    f"✅ Карточка продана за {price} тенге!\n"
-                    f"💰 Новый баланс: {user_data['balance']} тенге\n"
-                    f"🃏 Осталось карточек: {db.get_card_count(user_id)}"
+                    f"✅ Карточка продана за {result.total_price} тенге!\n"
+                    f"💰 Новый баланс: {result.balance} тенге\n"
+                    f"🃏 Осталось карточек: {result.card_count}"
                 )
             else:
-                await update.message.reply_text("❌ Карточка не найдена или уже продана!")
+                await update.message.reply_text(
+                    f"✅ Продано {result.sold_count} карточек за {result.total_price} тенге!\n"
+                    f"💰 Новый баланс: {result.balance} тенге\n"
+                    f"🃏 Осталось карточек: {result.card_count}"
+                )
 
-        except ValueError:
-            await update.message.reply_text("❌ Неверный ID карточки! Используйте число.")
         except Exception as e:
             logger.error(f"Ошибка при продаже: {e}")
             await update.message.reply_text("❌ Произошла ошибка при продаже!")
 
+    async def rebuild_leaderboard(self):
+        """Перечитать топ из БД"""
+        self.leaderboard.begin_rebuild()
+        await self.db.checkpoint_ledger()
+        self.leaderboard.load(await self.db.get_top_players(self.leaderboard.capacity))
+
     async def show_top_players(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать топ-10 игроков"""
         query = update.callback_query
         if query:
             await query.answer()
 
-        top_players = db.get_top_players(10)
+        if self.leaderboard.needs_rebuild:
+            await self.rebuild_leaderboard()
+        top_players = self.leaderboard.top(10)
 
         if not top_players:
             text = "🏆 Топ игроков пока пуст!"
@@ -305,7 +694,8 @@ class CardBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         if query:
-            await query.message.edit_text(text, reply_markup=reply_markup)
+            await self.edit_message(context.bot, query.message.chat_id, query.message.message_id,
+                                    text, reply_markup)
         else:
             await update.message.reply_text(text, reply_markup=reply_markup)
 
@@ -315,17 +705,60 @@ class CardBot:
         await query.answer()
 
         user_id = query.from_user.id
-        user_data = db.get_user(user_id)
+        user_data, card_count = await self.db.get_user_stats(user_id)
 
         text = (
             f"💰 Ваш баланс: {user_data['balance']} тенге\n"
-            f"🃏 Карточек в коллекции: {db.get_card_count(user_id)}"
+            f"🃏 Карточек в коллекции: {card_count}"
         )
 
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await query.message.edit_text(text, reply_markup=reply_markup)
+        await self.edit_message(context.bot, query.message.chat_id, query.message.message_id,
+                                text, reply_markup)
+
+    async def admit_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отсеять повторные и слишком частые нажатия, не доходя до БД и Telegram"""
+        query = update.callback_query
+        verdict = self.callback_guard.admit(query.from_user.id, query.data)
+        if verdict == ACCEPTED:
+            return
+        if self.metrics is not None:
+            self.metrics.callbacks_dropped.inc(reason=verdict)
+        if verdict == DUPLICATE:
+            # Повтор уже обработанного нажатия - только убираем "часики"
+            await query.answer()
+        else:
+            await query.answer("⏳ Не так быстро!")
+        raise ApplicationHandlerStop
+
+    async def finish_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        self.callback_guard.finish(query.from_user.id, query.data)
+
+    async def edit_message(self, bot, chat_id: int, message_id: int, text: str,
+                           reply_markup: InlineKeyboardMarkup = None):
+        """Изменить текст сообщения, если он или кнопки отличаются от отправленных ранее"""
+        key = (chat_id, message_id)
+        digest = hashlib.blake2b(text.encode(), digest_size=16)
+        if reply_markup is not None:
+            digest.update(reply_markup.to_json().encode())
+        digest = digest.digest()
+        if self._sent_edits.get(key) == digest:
+            self._sent_edits.move_to_end(key)
+            return
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=message_id,
+                                        text=text, reply_markup=reply_markup)
+        except BadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                self._sent_edits.pop(key, None)
+                raise
+        self._sent_edits[key] = digest
+        self._sent_edits.move_to_end(key)
+        while len(self._sent_edits) > self.config.EDIT_CACHE_SIZE:
+            self._sent_edits.popitem(last=False)
 
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик нажатий на кнопки"""
@@ -335,7 +768,7 @@ class CardBot:
         await query.answer()  # Убираем "часики" на кнопке
 
         if data == "check_subscription":
-            if await self.check_subscription(query.from_user.id):
+            if await self.check_subscription(query.from_user.id, fresh=True):
                 await self.show_main_menu(update, context, query.message.message_id)
             else:
                 await query.answer("Вы ещё не подписались!", show_alert=True)
@@ -343,10 +776,21 @@ class CardBot:
         elif data == "open_box":
             await self.open_box(update, context)
 
+        elif data == "open_all":
+            await self.open_box(update, context, count=self.config.OPEN_ALL_LIMIT)
+
         elif data == "my_cards":
             await self.show_cards(query.from_user.id, query.message.chat.id, context,
                                   query.message.message_id)
 
+        elif data.startswith("cards:"):
+            # Листание коллекции: cards:<l|g>[:<n|p>:<id>]
+            parts = data.split(":")
+            cursor = int(parts[3]) if len(parts) == 4 else None
+            await self.show_cards(query.from_user.id, query.message.chat.id, context,
+                                  query.message.message_id, grouped=parts[1] == "g",
+                                  cursor=cursor, newer=len(parts) == 4 and parts[2] == "p")
+
         elif data == "top_players":
             await self.show_top_players(update, context)
 
@@ -356,30 +800,20 @@ class CardBot:
         elif data == "main_menu":
             await self.show_main_menu(update, context, query.message.message_id)
 
-        elif data == "sell_all":
-            # Дополнительная функция: продать все карточки
+        elif data == "sell_all" or data.startswith("sell_rarity:"):
+            # Продать все карточки или все карточки одной редкости
             user_id = query.from_user.id
-            cards = db.get_user_cards(user_id)
+            rarity = data.split(":", 1)[1] if data.startswith("sell_rarity:") else None
+            result = await self.db.sell_cards(user_id, self.config.PRICES, rarity=rarity)
 
-            if not cards:
+            if not result.sold_count:
                 await query.answer("У вас нет карточек для продажи!", show_alert=True)
                 return
 
-            total_price = 0
-            sold_count = 0
-
-            for card in cards:
-                rarity = card['rarity']
-                price = self.config.PRICES.get(rarity, 0)
-                db.sell_card(card['id'], user_id)
-                db.update_balance(user_id, price)
-                total_price += price
-                sold_count += 1
-
-            user_data = db.get_user(user_id)
-            await query.message.edit_text(
-                f"💰 Продано {sold_count} карточек за {total_price} тенге!\n"
-                f"💵 Новый баланс: {user_data['balance']} тенге"
+            await self.edit_message(
+                context.bot, query.message.chat_id, query.message.message_id,
+                f"💰 Продано {result.sold_count} карточек за {result.total_price} тенге!\n"
+                f"💵 Новый баланс: {result.balance} тенге"
             )
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -390,10 +824,12 @@ class CardBot:
             "/start - Начать работу с ботом\n"
             "/cards - Показать ваши карточки\n"
             "/sell <id> - Продать карточку по ID\n"
+            "/sell <id> <id> <от-до> - Продать несколько карточек\n"
+            "/sell <редкость> - Продать все карточки редкости\n"
             "/help - Показать это сообщение\n\n"
             "📋 *Как работает бот:*\n"
             "1️⃣ Подпишитесь на канал\n"
-            "2️⃣ Каждый час можно открыть ящик\n"
+            "2️⃣ Каждый час копится ящик - можно открыть все накопленные сразу\n"
             "3️⃣ Получайте карточки разной редкости\n"
             "4️⃣ Продавайте карточки или собирайте коллекцию\n"
             "5️⃣ Соревнуйтесь с другими в топе\n\n"
@@ -407,11 +843,71 @@ class CardBot:
 
         await update.message.reply_text(help_text, parse_mode='Markdown')
 
+    async def on_shutdown(self, application: Application):
+        """Освобождение ресурсов при остановке"""
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.db.close()
+
+    async def run_webhook(self):
+        """Приём обновлений через webhook до сигнала остановки"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+
+        server = WebhookServer(
+            self.app,
+            host=self.config.WEBHOOK_LISTEN,
+            port=self.config.WEBHOOK_PORT,
+            path=self.config.WEBHOOK_PATH,
+            secret_token=self.config.WEBHOOK_SECRET,
+            queue_size=self.config.WEBHOOK_QUEUE_SIZE,
+            workers=self.config.WEBHOOK_WORKERS,
+            metrics=self.metrics
+        )
+        await self.app.initialize()
+        try:
+            await self.app.start()
+            await server.start()
+            if self.config.WEBHOOK_URL:
+                await self.app.bot.set_webhook(
+                    url=self.config.WEBHOOK_URL,
+                    secret_token=self.config.WEBHOOK_SECRET or None,
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=self.config.WEBHOOK_MAX_CONNECTIONS
+                )
+            else:
+                logger.warning("WEBHOOK_URL не задан - webhook не зарегистрирован в Telegram")
+            await stop.wait()
+        finally:
+            await server.stop()
+            if self.app.running:
+                await self.app.stop()
+            await self.app.shutdown()
+            await self.on_shutdown(self.app)
+
     def run(self):
         """Запуск бота"""
-        self.app.run_polling(allowed_updates=Update.ALL_TYPES)
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.config.UPDATE_MODE == "webhook":
+            asyncio.run(self.run_webhook())
+        else:
+            # run_polling сам снимает webhook, если он был установлен
+            self.app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
-    bot = CardBot()
-    bot.run()
\ No newline at end of file
+    if Config.WORKER_PROCESSES > 1:
+        Supervisor(
+            Config.WORKER_PROCESSES,
+            max_in_flight=Config.WORKER_MAX_IN_FLIGHT,
+            restart_delay=Config.WORKER_RESTART_DELAY
+        ).run()
+    else:
+        bot = CardBot()
+        bot.run()
\ No newline at end of file
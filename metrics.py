@@ -0,0 +1,353 @@
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import BaseRequest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.label_names, key)} {value}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счётчики по корзинам..., сумма, количество]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, [('le', repr(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.label_names, key, [('le', '+Inf')])
+        lines.append(f'{self.name}_bucket{labels} {state[-1]}')
+        labels = _format_labels(self.label_names, key)
+        lines.append(f'{self.name}_sum{labels} {state[-2]}')
+        lines.append(f'{self.name}_count{labels} {state[-1]}')
+        return lines
+
+
+class Registry:
+    """Набор метрик с выводом в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class BotMetrics:
+    """Метрики бота: запросы к БД, обработчики обновлений и вызовы Bot API"""
+
+    def __init__(self, slow_query_ms=100):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.registry = Registry()
+        self.db_query = self.registry.histogram(
+            'cardbot_db_query_seconds', 'Время выполнения методов Database', ['method'])
+        self.db_errors = self.registry.counter(
+            'cardbot_db_errors_total', 'Ошибки в методах Database', ['method'])
+        self.db_slow = self.registry.counter(
+            'cardbot_db_slow_queries_total', 'Медленные вызовы Database', ['method'])
+        self.db_pool_wait = self.registry.histogram(
+            'cardbot_db_pool_wait_seconds', 'Ожидание свободного соединения в пуле')
+        self.db_connection_hold = self.registry.histogram(
+            'cardbot_db_connection_hold_seconds', 'Сколько соединение было занято')
+        self.db_in_flight = self.registry.gauge(
+            'cardbot_db_in_flight', 'Выполняющиеся вызовы Database')
+        self.handler = self.registry.histogram(
+            'cardbot_handler_seconds', 'Время обработки обновления', ['handler', 'action'])
+        self.handler_errors = self.registry.counter(
+            'cardbot_handler_errors_total', 'Ошибки в обработчиках', ['handler', 'action'])
+        self.updates_in_flight = self.registry.gauge(
+            'cardbot_updates_in_flight', 'Обрабатываемые сейчас обновления')
+        self.api = self.registry.histogram(
+            'cardbot_bot_api_seconds', 'Время вызова Bot API', ['method'])
+        self.api_errors = self.registry.counter(
+            'cardbot_bot_api_errors_total', 'Ошибки вызовов Bot API', ['method'])
+        self.api_in_flight = self.registry.gauge(
+            'cardbot_bot_api_in_flight', 'Выполняющиеся вызовы Bot API')
+        self.webhook_queue = self.registry.gauge(
+            'cardbot_webhook_queue_depth', 'Обновления в очереди webhook')
+        self.webhook_rejected = self.registry.counter(
+            'cardbot_webhook_rejected_total', 'Обновления, отклонённые из-за полной очереди')
+        self.callbacks_dropped = self.registry.counter(
+            'cardbot_callbacks_dropped_total', 'Отброшенные нажатия на кнопки', ['reason'])
+
+    def render(self):
+        return self.registry.render()
+
+    def _timed_db_method(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            self.db_in_flight.inc()
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                self.db_errors.inc(method=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.db_in_flight.dec()
+                self.db_query.observe(elapsed, method=name)
+                if elapsed >= self.slow_query_seconds:
+                    self.db_slow.inc(method=name)
+                    logger.warning(f"Медленный запрос Database.{name}: {elapsed * 1000:.1f} мс")
+
+        return wrapper
+
+    def instrument_database(self, db):
+        """Обернуть методы экземпляра Database замерами времени"""
+        for name in dir(type(db)):
+            if name.startswith('_') or name in ('get_connection', 'transaction', 'close'):
+                continue
+            method = getattr(db, name)
+            if callable(method):
+                setattr(db, name, self._timed_db_method(name, method))
+
+        get_connection = db.get_connection
+
+        @contextmanager
+        def timed_connection():
+            started = time.perf_counter()
+            with get_connection() as conn:
+                yield conn
+            self.db_connection_hold.observe(time.perf_counter() - started)
+
+        db.get_connection = timed_connection
+
+        acquire = db.pool.acquire
+
+        def timed_acquire():
+            with self.db_pool_wait.time():
+                return acquire()
+
+        db.pool.acquire = timed_acquire
+
+    def instrument_handlers(self, application):
+        """Обернуть колбэки всех зарегистрированных обработчиков"""
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                handler.callback = self._timed_handler(handler.callback)
+
+    @staticmethod
+    def _action(update):
+        """Команда или префикс callback_data - для разбивки метрик по действиям"""
+        query = getattr(update, 'callback_query', None)
+        if query is not None and query.data:
+            return query.data.split(':', 1)[0]
+        message = getattr(update, 'message', None)
+        if message is not None and message.text and message.text.startswith('/'):
+            return message.text.split(maxsplit=1)[0]
+        return ''
+
+    def _timed_handler(self, callback):
+        name = getattr(callback, '__name__', type(callback).__name__)
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            action = self._action(update)
+            self.updates_in_flight.inc()
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except ApplicationHandlerStop:
+                # Штатная остановка обработки (например, отброшенное нажатие)
+                raise
+            except Exception:
+                self.handler_errors.inc(handler=name, action=action)
+                raise
+            finally:
+                self.updates_in_flight.dec()
+                self.handler.observe(time.perf_counter() - started, handler=name, action=action)
+
+        return wrapper
+
+
+class InstrumentedRequest(BaseRequest):
+    """HTTP-клиент Bot API с замером времени каждого вызова"""
+
+    def __init__(self, request, metrics):
+        self._request = request
+        self._metrics = metrics
+
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        endpoint = url.rsplit('/', 1)[-1]
+        self._metrics.api_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            code, payload = await self._request.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        except Exception:
+            self._metrics.api_errors.inc(method=endpoint)
+            raise
+        finally:
+            self._metrics.api_in_flight.dec()
+            self._metrics.api.observe(time.perf_counter() - started, method=endpoint)
+        if code >= 400:
+            self._metrics.api_errors.inc(method=endpoint)
+        return code, payload
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер с метриками в формате Prometheus (GET /metrics)"""
+
+    def __init__(self, metrics, host='127.0.0.1', port=9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        thread.start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
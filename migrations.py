@@ -0,0 +1,290 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Миграции схемы по порядку: (версия, описание, SQL-выражения).
+# Текущая версия хранится в PRAGMA user_version; уже применённые
+# миграции никогда не меняются - только добавляются новые.
+MIGRATIONS = [
+    (1, "базовая схема", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            balance INTEGER DEFAULT 0,
+            last_opened TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_cards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            card_name TEXT,
+            rarity TEXT,
+            file_path TEXT,
+            obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_sold BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS photo_cache (
+            file_path TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+
+    # Пути в cards хранятся с "/" независимо от ОС, на которой получена карточка
+    (2, "каталог карточек cards, user_cards ссылается на него по id", [
+        '''
+        CREATE TABLE cards (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            rarity TEXT NOT NULL,
+            file_path TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        INSERT INTO cards (name, rarity, file_path)
+        SELECT card_name, rarity, REPLACE(COALESCE(file_path, rarity || '/' || card_name), '\\', '/')
+        FROM user_cards
+        GROUP BY REPLACE(COALESCE(file_path, rarity || '/' || card_name), '\\', '/')
+        ORDER BY MIN(id)
+        ''',
+        '''
+        CREATE TABLE user_cards_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            card_id INTEGER NOT NULL REFERENCES cards (id),
+            obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_sold BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        INSERT INTO user_cards_new (id, user_id, card_id, obtained_at, is_sold)
+        SELECT uc.id, uc.user_id, c.id, uc.obtained_at, uc.is_sold
+        FROM user_cards uc
+        JOIN cards c
+          ON c.file_path = REPLACE(COALESCE(uc.file_path, uc.rarity || '/' || uc.card_name), '\\', '/')
+        ''',
+        # Сохраняем счётчик AUTOINCREMENT, чтобы id не использовались повторно
+        "DELETE FROM sqlite_sequence WHERE name = 'user_cards_new'",
+        "UPDATE sqlite_sequence SET name = 'user_cards_new' WHERE name = 'user_cards'",
+        'DROP TABLE user_cards',
+        'ALTER TABLE user_cards_new RENAME TO user_cards',
+        '''
+        CREATE VIEW user_cards_full AS
+        SELECT uc.id, uc.user_id, uc.card_id, c.name AS card_name, c.rarity, c.file_path,
+               uc.obtained_at, uc.is_sold
+        FROM user_cards uc
+        JOIN cards c ON c.id = uc.card_id
+        ''',
+    ]),
+
+    (3, "индексы для запросов по пользователю", [
+        # Страницы коллекции, подсчёт карточек и полная история пользователя
+        '''
+        CREATE INDEX idx_user_cards_user
+        ON user_cards (user_id, is_sold, obtained_at, id)
+        ''',
+        # Сгруппированный просмотр и подсчёт по редкостям
+        '''
+        CREATE INDEX idx_user_cards_unsold_card
+        ON user_cards (user_id, card_id) WHERE is_sold = 0
+        ''',
+    ]),
+
+    (4, "счётчик карточек в users и индекс для топа игроков", [
+        'ALTER TABLE users ADD COLUMN card_count INTEGER NOT NULL DEFAULT 0',
+        '''
+        UPDATE users SET card_count = (
+            SELECT COUNT(*) FROM user_cards
+            WHERE user_cards.user_id = users.user_id AND is_sold = 0
+        )
+        ''',
+        '''
+        CREATE TRIGGER trg_user_cards_insert AFTER INSERT ON user_cards
+        WHEN NEW.is_sold = 0
+        BEGIN
+            UPDATE users SET card_count = card_count + 1 WHERE user_id = NEW.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_user_cards_sold AFTER UPDATE OF is_sold ON user_cards
+        WHEN OLD.is_sold <> NEW.is_sold
+        BEGIN
+            UPDATE users
+            SET card_count = card_count + (CASE WHEN NEW.is_sold = 0 THEN 1 ELSE -1 END)
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_user_cards_delete AFTER DELETE ON user_cards
+        WHEN OLD.is_sold = 0
+        BEGIN
+            UPDATE users SET card_count = card_count - 1 WHERE user_id = OLD.user_id;
+        END
+        ''',
+        'CREATE INDEX idx_users_rank ON users (balance DESC, card_count DESC)',
+    ]),
+
+    # Заряды копятся с момента charges_from; с прежним интервалом в один
+    # ящик это то же, что время последнего открытия
+    (5, "заряды для открытия ящиков", [
+        'ALTER TABLE users ADD COLUMN charges_from TIMESTAMP',
+        'UPDATE users SET charges_from = last_opened',
+    ]),
+
+    # Баланс меняется только записями в журнал; users.balance - снимок на
+    # последнюю контрольную точку. Текущие балансы переносятся в журнал
+    # начальными записями, и первая точка совпадает с ними
+    (6, "журнал баланса с контрольными точками", [
+        '''
+        CREATE TABLE balance_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            ref INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX idx_balance_ledger_user ON balance_ledger (user_id, id)',
+        '''
+        CREATE TABLE ledger_checkpoints (
+            ledger_id INTEGER PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        INSERT INTO balance_ledger (user_id, amount, reason)
+        SELECT user_id, balance, 'opening' FROM users
+        WHERE balance <> 0
+        ORDER BY user_id
+        ''',
+        '''
+        INSERT INTO ledger_checkpoints (ledger_id)
+        SELECT COALESCE(MAX(id), 0) FROM balance_ledger
+        ''',
+    ]),
+
+    # Проданные карточки старше срока хранения переносятся в архив, чтобы
+    # user_cards и его индексы оставались небольшими. Время продажи уже
+    # проданных карточек неизвестно - срок отсчитывается от миграции.
+    # sold_at - местное время, как datetime.now() при продаже и в сроке
+    # архивации (CURRENT_TIMESTAMP - UTC). В БД, мигрированных до этой правки,
+    # такие карточки сдвинуты на часовой пояс - при сроке в дни это неважно
+    (7, "архив проданных карточек", [
+        'ALTER TABLE user_cards ADD COLUMN sold_at TIMESTAMP',
+        "UPDATE user_cards SET sold_at = datetime('now', 'localtime') WHERE is_sold = 1",
+        '''
+        CREATE INDEX idx_user_cards_sold
+        ON user_cards (sold_at) WHERE is_sold = 1
+        ''',
+        '''
+        CREATE TABLE user_cards_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            card_id INTEGER NOT NULL REFERENCES cards (id),
+            obtained_at TIMESTAMP,
+            sold_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE INDEX idx_user_cards_archive_user
+        ON user_cards_archive (user_id, obtained_at)
+        ''',
+        # Вся история карточек: текущие и архивные (архивные всегда проданы)
+        '''
+        CREATE VIEW user_cards_history AS
+        SELECT id, user_id, card_id, card_name, rarity, file_path, obtained_at, is_sold
+        FROM user_cards_full
+        UNION ALL
+        SELECT a.id, a.user_id, a.card_id, c.name, c.rarity, c.file_path, a.obtained_at, 1
+        FROM user_cards_archive a
+        JOIN cards c ON c.id = a.card_id
+        ''',
+    ]),
+
+    # Кнопкам продажи по редкостям на каждой странице коллекции нужны только
+    # эти счётчики - без подсчёта по всей коллекции при каждом просмотре.
+    # Цена - один upsert на каждую выданную или проданную карточку (порядка
+    # 5-10 мкс); страница коллекции перестаёт зависеть от её размера
+    (8, "счётчики непроданных карточек по редкостям", [
+        '''
+        CREATE TABLE user_rarity_counts (
+            user_id INTEGER NOT NULL,
+            rarity TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, rarity)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT INTO user_rarity_counts (user_id, rarity, count)
+        SELECT uc.user_id, c.rarity, COUNT(*)
+        FROM user_cards uc
+        JOIN cards c ON c.id = uc.card_id
+        WHERE uc.is_sold = 0
+        GROUP BY uc.user_id, c.rarity
+        ''',
+        '''
+        CREATE TRIGGER trg_user_rarity_insert AFTER INSERT ON user_cards
+        WHEN NEW.is_sold = 0
+        BEGIN
+            INSERT INTO user_rarity_counts (user_id, rarity, count)
+            SELECT NEW.user_id, rarity, 1 FROM cards WHERE id = NEW.card_id
+            ON CONFLICT (user_id, rarity) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_user_rarity_sold AFTER UPDATE OF is_sold ON user_cards
+        WHEN OLD.is_sold <> NEW.is_sold
+        BEGIN
+            INSERT INTO user_rarity_counts (user_id, rarity, count)
+            SELECT NEW.user_id, rarity, CASE WHEN NEW.is_sold = 0 THEN 1 ELSE -1 END
+            FROM cards WHERE id = NEW.card_id
+            ON CONFLICT (user_id, rarity) DO UPDATE SET count = count + excluded.count;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_user_rarity_delete AFTER DELETE ON user_cards
+        WHEN OLD.is_sold = 0
+        BEGIN
+            UPDATE user_rarity_counts SET count = count - 1
+            WHERE user_id = OLD.user_id
+              AND rarity = (SELECT rarity FROM cards WHERE id = OLD.card_id);
+        END
+        ''',
+    ]),
+]
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Применить недостающие миграции, каждую в своей транзакции"""
+    version = get_version(conn)
+    for target, description, statements in MIGRATIONS:
+        if target <= version:
+            continue
+
+        logger.info(f"Миграция схемы {target}: {description}")
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {int(target)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Миграция схемы {target} не применена")
+            raise
+        version = target
+    return version
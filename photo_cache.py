@@ -0,0 +1,67 @@
+import os
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoCache:
+    """Кэш file_id изображений, уже загруженных в Telegram.
+
+    Ключ - путь к файлу и хэш его содержимого: если картинку заменили,
+    хэш меняется и изображение загружается заново.
+    """
+
+    def __init__(self, db):
+        # AsyncDatabase
+        self.db = db
+        # path -> (mtime_ns, size, content_hash, file_id)
+        self._entries = {}
+
+    @staticmethod
+    def file_hash(path):
+        """SHA-256 содержимого файла"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    async def _lookup(self, path):
+        """Актуальная запись для файла; хэш пересчитывается только при изменении файла"""
+        stat = os.stat(path)
+        entry = self._entries.get(path)
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            if entry[3] is None:
+                # Картинку мог уже загрузить другой процесс бота (см. supervisor.py)
+                file_id = await self.db.get_photo_file_id(path, entry[2])
+                if file_id is not None:
+                    entry = entry[:3] + (file_id,)
+                    self._entries[path] = entry
+            return entry
+
+        content_hash = await asyncio.to_thread(self.file_hash, path)
+        file_id = await self.db.get_photo_file_id(path, content_hash)
+        entry = (stat.st_mtime_ns, stat.st_size, content_hash, file_id)
+        self._entries[path] = entry
+        return entry
+
+    async def get_file_id(self, path):
+        """file_id для файла или None, если файл ещё не загружался"""
+        try:
+            return (await self._lookup(path))[3]
+        except OSError as e:
+            logger.error(f"Ошибка при чтении изображения {path}: {e}")
+            return None
+
+    async def remember(self, path, file_id):
+        """Сохранить file_id, полученный после загрузки файла"""
+        mtime_ns, size, content_hash, _ = await self._lookup(path)
+        self._entries[path] = (mtime_ns, size, content_hash, file_id)
+        await self.db.save_photo_file_id(path, content_hash, file_id)
+
+    async def forget(self, path):
+        """Сбросить file_id (например, если Telegram его больше не принимает)"""
+        self._entries.pop(path, None)
+        await self.db.delete_photo_file_id(path)
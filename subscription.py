@@ -0,0 +1,71 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+
+class SubscriptionCache:
+    """Кэш результатов проверки подписки на канал.
+
+    Положительный и отрицательный ответы хранятся разное время, размер
+    ограничен (вытесняются давно не использованные записи), а одновременные
+    проверки одного пользователя объединяются в один запрос к Telegram.
+    """
+
+    def __init__(self, fetch, positive_ttl=600, negative_ttl=30, max_size=10000):
+        # fetch(user_id) -> bool, корутина с запросом к Telegram
+        self._fetch = fetch
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        # user_id -> (подписан, время истечения)
+        self._entries = OrderedDict()
+        # user_id -> задача с выполняющимся запросом
+        self._pending = {}
+
+    def _store(self, user_id, is_member):
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        self._entries[user_id] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _load(self, user_id):
+        try:
+            is_member = await self._fetch(user_id)
+            # Результат устарел, если за время запроса пришло обновление из канала
+            if self._pending.get(user_id) is asyncio.current_task():
+                self._store(user_id, is_member)
+            return is_member
+        finally:
+            if self._pending.get(user_id) is asyncio.current_task():
+                del self._pending[user_id]
+
+    async def is_subscribed(self, user_id, fresh=False):
+        """Подписан ли пользователь; fresh=True перепроверяет отрицательный ответ"""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            is_member, expires_at = entry
+            if expires_at > time.monotonic() and (is_member or not fresh):
+                self._entries.move_to_end(user_id)
+                return is_member
+
+        task = self._pending.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(user_id))
+            self._pending[user_id] = task
+        # Отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def set(self, user_id, is_member):
+        """Обновить запись по событию из канала"""
+        self._pending.pop(user_id, None)
+        self._store(user_id, is_member)
+
+    def invalidate(self, user_id):
+        self._pending.pop(user_id, None)
+        self._entries.pop(user_id, None)
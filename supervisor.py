@@ -0,0 +1,375 @@
+"""Многопроцессный режим: супервизор и рабочие процессы бота.
+
+Супервизор сам получает обновления (polling или webhook) и раздаёт их
+рабочим процессам по id игрока: все обновления одного игрока попадают в
+один и тот же процесс. Поэтому заряды, кэш подписок и порядок обработки
+игрока живут в памяти одного процесса так же, как в обычном режиме.
+
+Общие ресурсы:
+- SQLite: WAL и busy_timeout - записи разных процессов идут по очереди
+  через BEGIN IMMEDIATE, миграции выполняет супервизор до запуска процессов;
+- изображения карточек обрабатывает супервизор, процессы читают готовый
+  манифест;
+- file_id хранятся в БД: пока процесс не знает file_id картинки, он
+  перечитывает его из БД перед загрузкой (см. PhotoCache);
+- таймеры "ящик готов" каждый процесс ведёт только для своих игроков, а
+  контрольные точки журнала и архивацию выполняет только процесс 0;
+- топ игроков каждый процесс перестраивает из БД раз в
+  LEADERBOARD_REFRESH_SECONDS, потому что видит только записи своих игроков;
+- общий лимит исходящих сообщений делится поровну между процессами.
+
+Супервизор помнит обновления, которые процесс ещё не подтвердил. Если
+процесс упал, он перезапускается, и неподтверждённые обновления отдаются
+ему заново в прежнем порядке (обновление, которое упавший процесс успел
+частично обработать, может выполниться второй раз).
+"""
+import json
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+
+from telegram import Bot, Update
+from telegram.error import RetryAfter, TelegramError
+
+from config import Config
+from database import Database
+from catalog import CardCatalog
+from assets import AssetPipeline
+from webhook import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(key, workers):
+    """Номер процесса, за которым закреплён игрок (или чат) key"""
+    return key % workers
+
+
+def routing_key(data):
+    """id игрока, за процессом которого закрепляется обновление"""
+    member = data.get('chat_member')
+    if member:
+        # Подписка меняется у участника канала, а не у того, кто её изменил
+        return member['new_chat_member']['user']['id']
+    for value in data.values():
+        if isinstance(value, dict):
+            user = value.get('from') or value.get('user')
+            if user:
+                return user['id']
+            chat = value.get('chat')
+            if chat:
+                return chat['id']
+    return data['update_id']
+
+
+def worker_main(index, workers, inbox, acks):
+    """Точка входа рабочего процесса"""
+    # Остановку процессов по Ctrl+C выполняет супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Config.FLOOD_GLOBAL_RATE = Config.FLOOD_GLOBAL_RATE / workers
+    Config.METRICS_PORT = Config.METRICS_PORT + 1 + index
+
+    from main import CardBot
+    bot = CardBot(shard=(index, workers))
+    if bot.metrics_server is not None:
+        bot.metrics_server.start()
+    asyncio.run(serve_worker(bot, inbox, acks))
+
+
+async def serve_worker(bot, inbox, acks):
+    """Обрабатывать обновления из inbox, пока не придёт None"""
+    app = bot.app
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def handle(data):
+        try:
+            update = Update.de_json(data, app.bot)
+            # Через update_processor, как и при run_polling
+            await app.update_processor.process_update(update, app.process_update(update))
+        except Exception:
+            logger.exception("Ошибка обработки обновления")
+        finally:
+            acks.send(data['update_id'])
+
+    async def refresh_leaderboard(context):
+        # Записи других процессов этот процесс не видит - топ перечитывается из БД
+        # сразу, а не при следующем /top
+        bot.leaderboard.invalidate()
+        try:
+            await bot.rebuild_leaderboard()
+        except Exception as e:
+            logger.error(f"Ошибка обновления топа игроков: {e}")
+
+    await app.initialize()
+    try:
+        await app.start()
+        if app.job_queue is not None:
+            app.job_queue.run_repeating(
+                refresh_leaderboard,
+                interval=bot.config.LEADERBOARD_REFRESH_SECONDS,
+                first=bot.config.LEADERBOARD_REFRESH_SECONDS,
+                name="leaderboard_refresh"
+            )
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is None:
+                break
+            task = asyncio.create_task(handle(data))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        await bot.on_shutdown(app)
+        acks.close()
+
+
+class RoutingWebhookServer(WebhookServer):
+    """Webhook супервизора: обновления не разбираются, а сразу раздаются процессам"""
+
+    def __init__(self, supervisor, **kwargs):
+        super().__init__(None, workers=0, **kwargs)
+        self.supervisor = supervisor
+
+    def _enqueue(self, body):
+        if not self._accepting:
+            return 503
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or 'update_id' not in data:
+            logger.warning("Webhook: не удалось разобрать обновление")
+            return 400
+        # Процесс игрока перегружен - Telegram повторит доставку позже
+        return 200 if self.supervisor.offer(data) else 429
+
+
+class Supervisor:
+    """Запуск N рабочих процессов и раздача им обновлений по id игрока"""
+
+    def __init__(self, workers, max_in_flight=1000, restart_delay=1.0):
+        self.config = Config()
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.restart_delay = restart_delay
+        # spawn: процессы не наследуют потоки и соединения супервизора
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = [None] * workers
+        self._inboxes = [None] * workers
+        # Неподтверждённые обновления процесса: update_id -> данные (в порядке поступления)
+        self._in_flight = [{} for _ in range(workers)]
+        self._space = [asyncio.Event() for _ in range(workers)]
+        self._loop = None
+        self._stopping = False
+        self.restarts = 0
+
+    def prepare(self):
+        """Подготовить общие ресурсы до запуска процессов"""
+        # Миграции выполняются один раз, а не наперегонки в каждом процессе
+        Database(self.config.DB_PATH, pool_size=1).close()
+        if self.config.ASSETS_ENABLED:
+            catalog = CardCatalog(self.config.CARDS_PATH, self.config.DROP_RATES,
+                                  extensions=self.config.CARD_EXTENSIONS)
+            pipeline = AssetPipeline(
+                self.config.ASSETS_CACHE_PATH,
+                max_side=self.config.ASSET_MAX_SIDE,
+                quality=self.config.ASSET_QUALITY,
+                image_format=self.config.ASSET_FORMAT,
+                workers=self.config.ASSET_WORKERS
+            )
+            pipeline.build([card.path for cards in catalog.snapshot.cards.values() for card in cards])
+
+    def _spawn(self, index):
+        inbox = self._context.Queue()
+        ack_reader, ack_writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=worker_main,
+            args=(index, self.workers, inbox, ack_writer),
+            name=f'card-bot-worker-{index}'
+        )
+        process.start()
+        # Своя копия конца для записи закрыта: когда процесс завершится, чтение получит EOF
+        ack_writer.close()
+        self._processes[index] = process
+        self._inboxes[index] = inbox
+        threading.Thread(
+            target=self._read_acks, args=(index, process, ack_reader),
+            name=f'worker-acks-{index}', daemon=True
+        ).start()
+
+        # Недообработанное упавшим процессом отдаём заново
+        for data in self._in_flight[index].values():
+            inbox.put(data)
+        logger.info(f"Рабочий процесс {index} запущен (pid {process.pid})")
+
+    def _read_acks(self, index, process, reader):
+        """Поток чтения подтверждений процесса; EOF - процесс завершился"""
+        try:
+            while True:
+                update_id = reader.recv()
+                self._loop.call_soon_threadsafe(self._ack, index, update_id)
+        except (EOFError, OSError):
+            pass
+        finally:
+            reader.close()
+        process.join()
+        self._loop.call_soon_threadsafe(self._on_exit, index, process)
+
+    def _ack(self, index, update_id):
+        in_flight = self._in_flight[index]
+        in_flight.pop(update_id, None)
+        if len(in_flight) < self.max_in_flight:
+            self._space[index].set()
+
+    def _on_exit(self, index, process):
+        if self._processes[index] is not process:
+            return
+        self._inboxes[index] = None
+        if self._stopping:
+            return
+        self.restarts += 1
+        logger.error(
+            f"Рабочий процесс {index} завершился с кодом {process.exitcode}, "
+            f"перезапуск; неподтверждённых обновлений: {len(self._in_flight[index])}"
+        )
+        self._loop.call_later(self.restart_delay, self._restart, index)
+
+    def _restart(self, index):
+        if not self._stopping:
+            self._spawn(index)
+
+    def _route(self, data):
+        return shard_of(routing_key(data), self.workers)
+
+    def _put(self, index, data):
+        self._in_flight[index][data['update_id']] = data
+        inbox = self._inboxes[index]
+        # Пока процесс перезапускается, обновление ждёт в _in_flight
+        if inbox is not None:
+            inbox.put(data)
+
+    def offer(self, data):
+        """Отдать обновление процессу без ожидания; False, если процесс перегружен"""
+        index = self._route(data)
+        if len(self._in_flight[index]) >= self.max_in_flight:
+            return False
+        self._put(index, data)
+        return True
+
+    async def dispatch(self, data):
+        """Отдать обновление процессу, дождавшись места в его очереди"""
+        index = self._route(data)
+        while len(self._in_flight[index]) >= self.max_in_flight:
+            self._space[index].clear()
+            await self._space[index].wait()
+        self._put(index, data)
+
+    @property
+    def pending_updates(self):
+        return sum(len(in_flight) for in_flight in self._in_flight)
+
+    async def poll(self, bot):
+        """Получение обновлений через getUpdates"""
+        await bot.delete_webhook()
+        offset = None
+        try:
+            while True:
+                try:
+                    updates = await bot.get_updates(offset=offset, timeout=30,
+                                                    allowed_updates=Update.ALL_TYPES)
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                except TelegramError as e:
+                    logger.error(f"Ошибка при получении обновлений: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    offset = update.update_id + 1
+                    await self.dispatch(update.to_dict())
+        finally:
+            if offset is not None:
+                # Подтверждаем полученное, чтобы Telegram не прислал его снова
+                try:
+                    await bot.get_updates(offset=offset, timeout=0, limit=1)
+                except TelegramError as e:
+                    logger.warning(f"Не удалось подтвердить полученные обновления: {e}")
+
+    async def serve(self, stop):
+        """Раздавать обновления до установки события stop"""
+        self._loop = asyncio.get_running_loop()
+        for index in range(self.workers):
+            self._spawn(index)
+
+        bot = Bot(self.config.TOKEN)
+        server = None
+        poller = None
+        await bot.initialize()
+        try:
+            if self.config.UPDATE_MODE == "webhook":
+                server = RoutingWebhookServer(
+                    self,
+                    host=self.config.WEBHOOK_LISTEN,
+                    port=self.config.WEBHOOK_PORT,
+                    path=self.config.WEBHOOK_PATH,
+                    secret_token=self.config.WEBHOOK_SECRET
+                )
+                await server.start()
+                if self.config.WEBHOOK_URL:
+                    await bot.set_webhook(
+                        url=self.config.WEBHOOK_URL,
+                        secret_token=self.config.WEBHOOK_SECRET or None,
+                        allowed_updates=Update.ALL_TYPES,
+                        max_connections=self.config.WEBHOOK_MAX_CONNECTIONS
+                    )
+                else:
+                    logger.warning("WEBHOOK_URL не задан - webhook не зарегистрирован в Telegram")
+            else:
+                poller = asyncio.create_task(self.poll(bot), name='supervisor-poll')
+            await stop.wait()
+        finally:
+            if server is not None:
+                await server.stop()
+            if poller is not None:
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+            await bot.shutdown()
+            await self.stop_workers()
+
+    async def stop_workers(self, timeout=30):
+        """Попросить процессы дообработать очередь и дождаться их завершения"""
+        self._stopping = True
+        processes = [process for process in self._processes if process is not None]
+        for inbox in self._inboxes:
+            if inbox is not None:
+                inbox.put(None)
+        for process in processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"Рабочий процесс {process.name} не завершился, останавливаем")
+                process.terminate()
+        if self.pending_updates:
+            logger.warning(f"Не обработано обновлений: {self.pending_updates}")
+
+    async def main(self):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        await self.serve(stop)
+
+    def run(self):
+        """Запуск супервизора"""
+        self.prepare()
+        logger.info(f"Супервизор запущен, рабочих процессов: {self.workers}")
+        asyncio.run(self.main())
@@ -0,0 +1,45 @@
+import sqlite3
+import unittest
+
+from benchmark import QueryCounter
+
+
+class QueryCounterTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript('''
+            CREATE TABLE cards (id INTEGER PRIMARY KEY, is_sold INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE counts (sold INTEGER NOT NULL);
+            INSERT INTO counts VALUES (0);
+            CREATE TRIGGER trg_sold AFTER UPDATE OF is_sold ON cards
+            BEGIN
+                UPDATE counts SET sold = sold + 1;
+            END;
+            INSERT INTO cards (is_sold) VALUES (0), (0), (0), (0), (0);
+        ''')
+        self.counter = QueryCounter()
+        self.counter.on_connect(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_trigger_firings_are_one_statement(self):
+        self.conn.execute('UPDATE cards SET is_sold = 1')
+        self.assertEqual(self.conn.execute('SELECT sold FROM counts').fetchone()[0], 5)
+        # BEGIN, UPDATE, SELECT
+        self.assertEqual(self.counter.count, 3)
+
+    def test_executemany_counts_each_row(self):
+        self.conn.executemany('UPDATE cards SET is_sold = 1 WHERE id = ?', [(1,), (2,), (3,)])
+        # BEGIN и три выполнения UPDATE
+        self.assertEqual(self.counter.count, 4)
+
+    def test_repeated_statement_is_counted_again(self):
+        self.conn.execute('SELECT COUNT(*) FROM cards').fetchone()
+        self.conn.execute('UPDATE cards SET is_sold = 1 WHERE id = 1')
+        self.conn.execute('SELECT COUNT(*) FROM cards').fetchone()
+        self.assertEqual(self.counter.count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
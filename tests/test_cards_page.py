@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+from collections import Counter
+
+from database import Database
+
+RARITIES = ['Обычный', 'Редкий', 'Мифик', 'Обычный', 'Редкий']
+
+
+class CardsPageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, 'bot_database.db'), pool_size=1)
+        self.db.add_user(1, 'one')
+        self.db.add_user(2, 'two')
+        self.card_ids = [
+            self.db.get_card_id(f'card{i}', rarity, f'data/{rarity}/card{i}.png')
+            for i, rarity in enumerate(RARITIES)
+        ]
+        rows = []
+        for i in range(13):
+            # Часть карточек получена в одну и ту же секунду - порядок решает id
+            obtained_at = f'2024-01-01 10:00:{i // 3:02d}'
+            rows.append((1, self.card_ids[i % len(self.card_ids)], obtained_at, int(i in (4, 8))))
+        rows.append((2, self.card_ids[0], '2024-01-01 10:00:30', 0))
+        with self.db.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO user_cards (user_id, card_id, obtained_at, is_sold) VALUES (?, ?, ?, ?)
+            ''', rows)
+            self.unsold = [tuple(row) for row in conn.execute('''
+                SELECT id, card_id, obtained_at FROM user_cards
+                WHERE user_id = 1 AND is_sold = 0
+            ''')]
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def walk(self, limit, grouped=False):
+        """Страницы вперёд от начала: [(id строк, has_prev, has_next)]"""
+        pages = []
+        cursor = None
+        while True:
+            page = self.db.get_cards_page(1, limit, cursor=cursor, grouped=grouped)
+            pages.append(([row['id'] for row in page.rows], page.has_prev, page.has_next))
+            if not page.has_next:
+                return pages
+            cursor = page.rows[-1]['id']
+
+    def walk_back(self, pages, limit, grouped=False):
+        """Страницы назад от последней из pages"""
+        back = [pages[-1]]
+        while back[-1][1]:
+            page = self.db.get_cards_page(1, limit, cursor=back[-1][0][0], newer=True, grouped=grouped)
+            back.append(([row['id'] for row in page.rows], page.has_prev, page.has_next))
+        return back[::-1]
+
+    def test_list_forward(self):
+        expected = [card_id for card_id, _, obtained_at in
+                    sorted(self.unsold, key=lambda row: (row[2], row[0]), reverse=True)]
+        pages = self.walk(4)
+        self.assertEqual([ids for ids, _, _ in pages], [expected[:4], expected[4:8], expected[8:]])
+        self.assertEqual([(prev, more) for _, prev, more in pages],
+                         [(False, True), (True, True), (True, False)])
+
+    def test_list_backward_returns_same_pages(self):
+        pages = self.walk(4)
+        back = self.walk_back(pages, 4)
+        self.assertEqual([ids for ids, _, _ in back], [ids for ids, _, _ in pages])
+        # Назад от второй страницы - первая, у неё нет предыдущей
+        self.assertEqual(back[0][1:], (False, True))
+
+    def test_cursor_of_sold_card(self):
+        pages = self.walk(4)
+        cursor = pages[0][0][-1]
+        self.db.sell_cards(1, {}, card_ids=[cursor])
+        page = self.db.get_cards_page(1, 4, cursor=cursor)
+        self.assertEqual([row['id'] for row in page.rows], pages[1][0])
+
+    def test_grouped_forward_and_backward(self):
+        counts = Counter(card_id for _, card_id, _ in self.unsold)
+        pages = self.walk(2, grouped=True)
+        self.assertEqual([card_id for ids, _, _ in pages for card_id in ids], sorted(counts))
+        self.assertEqual([len(ids) for ids, _, _ in pages], [2, 2, 1])
+        self.assertEqual(pages[-1][1:], (True, False))
+
+        back = self.walk_back(pages, 2, grouped=True)
+        self.assertEqual([ids for ids, _, _ in back], [ids for ids, _, _ in pages])
+
+        page = self.db.get_cards_page(1, 10, grouped=True)
+        self.assertEqual({row['id']: row['count'] for row in page.rows}, dict(counts))
+
+    def test_rarity_counts(self):
+        page = self.db.get_cards_page(1, 4)
+        rarities = dict(zip(self.card_ids, RARITIES))
+        expected = Counter(rarities[card_id] for _, card_id, _ in self.unsold)
+        self.assertEqual(page.rarity_counts, dict(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
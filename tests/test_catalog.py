@@ -0,0 +1,82 @@
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+
+from catalog import AliasSampler, CardCatalog
+
+DROP_RATES = {
+    "Обычный": 40,
+    "Редкий": 30,
+    "Легендарный": 15,
+    "Мифик": 10,
+    "Секрет": 5
+}
+
+
+def table_rates(sampler):
+    """Вероятности элементов, заданные таблицами prob/alias"""
+    n = len(sampler.items)
+    rates = [0.0] * n
+    for i in range(n):
+        rates[i] += sampler._prob[i] / n
+        rates[sampler._alias[i]] += (1.0 - sampler._prob[i]) / n
+    return dict(zip(sampler.items, rates))
+
+
+class AliasSamplerTest(unittest.TestCase):
+    def test_table_matches_weights(self):
+        sampler = AliasSampler(list(DROP_RATES), list(DROP_RATES.values()))
+        for rarity, rate in table_rates(sampler).items():
+            self.assertAlmostEqual(rate, DROP_RATES[rarity] / 100, places=12)
+
+    def test_seeded_rng_is_reproducible(self):
+        sampler = AliasSampler(list(DROP_RATES), list(DROP_RATES.values()))
+        rng_a, rng_b = random.Random(42), random.Random(42)
+        self.assertEqual([sampler.sample(rng_a) for _ in range(1000)],
+                         [sampler.sample(rng_b) for _ in range(1000)])
+
+    def test_invalid_weights(self):
+        with self.assertRaises(ValueError):
+            AliasSampler([], [])
+        with self.assertRaises(ValueError):
+            AliasSampler(['a', 'b'], [0, 0])
+
+
+class CardCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        files = {"Обычный": 3, "Редкий": 2, "Легендарный": 0, "Мифик": 1}
+        # "Легендарный" - пустая папка, "Секрет" - папки нет
+        for rarity, count in files.items():
+            os.mkdir(os.path.join(self.tmp.name, rarity))
+            for i in range(count):
+                open(os.path.join(self.tmp.name, rarity, f'card{i}.png'), 'wb').close()
+        self.catalog = CardCatalog(self.tmp.name, DROP_RATES)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_expected_rates_skip_empty_rarities(self):
+        # Веса непустых редкостей перенормируются: 40 + 30 + 10 = 80
+        expected = {"Обычный": 0.5, "Редкий": 0.375, "Мифик": 0.125}
+        rates = self.catalog.expected_rates()
+        self.assertEqual(set(rates), set(expected))
+        for rarity, rate in expected.items():
+            self.assertAlmostEqual(rates[rarity], rate, places=12)
+        for rarity, rate in table_rates(self.catalog.snapshot.sampler).items():
+            self.assertAlmostEqual(rate, rates[rarity], places=12)
+
+    def test_empirical_frequencies(self):
+        rng = random.Random(20240601)
+        draws = 200000
+        counts = Counter(self.catalog.random_card(rng).rarity for _ in range(draws))
+        for rarity, rate in self.catalog.expected_rates().items():
+            # Стандартное отклонение доли - не больше 0.0012 при 200000 попыток
+            self.assertAlmostEqual(counts[rarity] / draws, rate, delta=0.005)
+        self.assertEqual(set(counts), {"Обычный", "Редкий", "Мифик"})
+
+
+if __name__ == '__main__':
+    unittest.main()
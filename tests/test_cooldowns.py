@@ -0,0 +1,29 @@
+import unittest
+from datetime import datetime, timedelta
+
+from cooldowns import CooldownService
+
+
+class CooldownServiceTest(unittest.TestCase):
+    def test_prune_forgets_full_charges(self):
+        service = CooldownService(cooldown_seconds=60, max_charges=2, tick=10, timers=False)
+        now = datetime(2024, 1, 1, 12, 0)
+        service.update(1, now, now)
+        service.update(2, now - timedelta(seconds=90), now)
+
+        self.assertEqual(service.pending_timers, 0)
+        self.assertEqual(service.prune(now), 0)
+        # Через 2 минуты у обоих заряды полные
+        self.assertEqual(service.prune(now + timedelta(seconds=120)), 2)
+        self.assertEqual(service.charges(1, now + timedelta(seconds=120)), (2, 0))
+
+    def test_timers_only_when_enabled(self):
+        now = datetime.now()
+        service = CooldownService(cooldown_seconds=60, max_charges=1, tick=10)
+        service.update(1, now, now)
+        self.assertEqual(service.pending_timers, 1)
+        self.assertEqual(service.pop_due(now + timedelta(seconds=80)), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
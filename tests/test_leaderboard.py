@@ -0,0 +1,51 @@
+import unittest
+
+from leaderboard import Leaderboard
+
+
+def row(user_id, balance, card_count=0):
+    return {'user_id': user_id, 'username': str(user_id), 'balance': balance, 'card_count': card_count}
+
+
+class LeaderboardTest(unittest.TestCase):
+    def test_changes_during_rebuild_are_applied_after_load(self):
+        leaderboard = Leaderboard(size=2, slack=1)
+        leaderboard.invalidate()
+        leaderboard.begin_rebuild()
+        # Топ прочитан из БД, затем до load() пришли изменения
+        snapshot = [row(1, 100), row(2, 50), row(3, 10)]
+        leaderboard.observe(4, '4', 500, 0)
+        leaderboard.observe(1, '1', 150, 0)
+        leaderboard.load(snapshot)
+
+        self.assertFalse(leaderboard.needs_rebuild)
+        self.assertEqual([(p['user_id'], p['balance']) for p in leaderboard.top()],
+                         [(4, 500), (1, 150)])
+
+    def test_pending_keeps_latest_value(self):
+        leaderboard = Leaderboard(size=2, slack=1)
+        leaderboard.invalidate()
+        leaderboard.begin_rebuild()
+        leaderboard.observe(1, '1', 500, 0)
+        leaderboard.observe(1, '1', 20, 0)
+        leaderboard.load([row(1, 100), row(2, 50)])
+        self.assertEqual([(p['user_id'], p['balance']) for p in leaderboard.top()],
+                         [(2, 50), (1, 20)])
+
+    def test_stale_top_does_not_buffer_before_rebuild(self):
+        leaderboard = Leaderboard(size=2, slack=1)
+        leaderboard.invalidate()
+        # Изменения до начала чтения уже есть в БД - хранить их не нужно
+        for user_id in range(1000):
+            leaderboard.observe(user_id, str(user_id), user_id, 0)
+        self.assertEqual(leaderboard._pending, {})
+
+        leaderboard.begin_rebuild()
+        leaderboard.observe(5, '5', 5000, 0)
+        leaderboard.load([row(999, 999), row(998, 998), row(997, 997)])
+        self.assertEqual([p['user_id'] for p in leaderboard.top()], [5, 999])
+        self.assertEqual(leaderboard._pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
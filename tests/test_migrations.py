@@ -0,0 +1,111 @@
+import os
+import time
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from database import Database
+from migrations import MIGRATIONS
+
+# Строки user_cards в базовой схеме (до каталога cards):
+# (id, user_id, card_name, rarity, file_path, obtained_at, is_sold)
+BASELINE_CARDS = [
+    (1, 1, 'Кот', 'Обычный', 'data\\Обычный\\Кот.png', '2024-01-01 10:00:00', 0),
+    (2, 1, 'Кот', 'Обычный', 'data/Обычный/Кот.png', '2024-01-02 10:00:00', 1),
+    (3, 2, 'Пёс', 'Редкий', None, '2024-01-03 10:00:00', 0),
+    (5, 2, 'Кот', 'Обычный', 'data/Обычный/Кот.png', '2024-01-04 10:00:00', 0),
+    (7, 1, 'Дракон', 'Мифик', 'data/Мифик/Дракон.png', '2024-01-05 10:00:00', 0),
+]
+
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'bot_database.db')
+        self.build_baseline()
+        self.db = Database(self.path, pool_size=1)
+
+    def build_baseline(self):
+        conn = sqlite3.connect(self.path)
+        for statement in MIGRATIONS[0][2]:
+            conn.execute(statement)
+        conn.executemany('INSERT INTO users (user_id, username, balance) VALUES (?, ?, ?)',
+                         [(1, 'one', 100), (2, 'two', 0)])
+        conn.executemany('''
+            INSERT INTO user_cards (id, user_id, card_name, rarity, file_path, obtained_at, is_sold)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', BASELINE_CARDS)
+        # Последний выданный id удалён: счётчик AUTOINCREMENT впереди MAX(id)
+        conn.execute("INSERT INTO user_cards (id, user_id, card_name, rarity) VALUES (9, 1, 'x', 'x')")
+        conn.execute('DELETE FROM user_cards WHERE id = 9')
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def query(self, sql, params=()):
+        with self.db.get_connection() as conn:
+            return [tuple(row) for row in conn.execute(sql, params)]
+
+    def test_schema_version(self):
+        self.assertEqual(self.query('PRAGMA user_version'), [(MIGRATIONS[-1][0],)])
+
+    def test_catalog_normalizes_paths(self):
+        self.assertEqual(self.query('SELECT id, name, rarity, file_path FROM cards ORDER BY id'), [
+            (1, 'Кот', 'Обычный', 'data/Обычный/Кот.png'),
+            (2, 'Пёс', 'Редкий', 'Редкий/Пёс'),
+            (3, 'Дракон', 'Мифик', 'data/Мифик/Дракон.png'),
+        ])
+
+    def test_ids_and_card_links_preserved(self):
+        rows = self.query('''
+            SELECT id, user_id, card_name, rarity, obtained_at, is_sold
+            FROM user_cards_full ORDER BY id
+        ''')
+        self.assertEqual(rows, [
+            (card_id, user_id, name, rarity, obtained_at, is_sold)
+            for card_id, user_id, name, rarity, _, obtained_at, is_sold in BASELINE_CARDS
+        ])
+
+    def test_autoincrement_continues(self):
+        self.assertEqual(self.query("SELECT name, seq FROM sqlite_sequence WHERE name LIKE 'user_cards%'"),
+                         [('user_cards', 9)])
+        with self.db.get_connection() as conn:
+            new_id = conn.execute('INSERT INTO user_cards (user_id, card_id) VALUES (1, 1)').lastrowid
+        self.assertEqual(new_id, 10)
+
+    def test_counters_backfilled(self):
+        self.assertEqual(self.query('SELECT user_id, card_count FROM users ORDER BY user_id'),
+                         [(1, 2), (2, 2)])
+        self.assertEqual(self.query('''
+            SELECT user_id, rarity, count FROM user_rarity_counts ORDER BY user_id, rarity
+        '''), [(1, 'Мифик', 1), (1, 'Обычный', 1), (2, 'Обычный', 1), (2, 'Редкий', 1)])
+        self.assertEqual(self.db.get_user(1)['balance'], 100)
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), "нужен time.tzset")
+    def test_sold_at_backfill_uses_local_time(self):
+        self.db.close()
+        os.remove(self.path)
+        old_tz = os.environ.get('TZ')
+        # Пояс UTC+5 без tzdata; срок архивации считается от datetime.now()
+        os.environ['TZ'] = '<+05>-5'
+        time.tzset()
+        try:
+            self.build_baseline()
+            self.db = Database(self.path, pool_size=1)
+            (sold_at,), = self.query('SELECT sold_at FROM user_cards WHERE id = 2')
+            delta = datetime.now() - datetime.fromisoformat(sold_at)
+        finally:
+            if old_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = old_tz
+            time.tzset()
+        self.assertLess(abs(delta.total_seconds()), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import time
+import asyncio
+import unittest
+
+from telegram import Update
+
+from update_processor import PerUserUpdateProcessor
+
+
+def make_update(update_id, user_id):
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+            'text': 'x',
+        },
+    }, None)
+
+
+class PerUserUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_pending_limit_sizes_outer_semaphore(self):
+        processor = PerUserUpdateProcessor(4, max_pending_updates=64)
+        self.assertEqual(processor.max_concurrent_updates, 4)
+        self.assertEqual(processor._semaphore._value, 64)
+
+    async def test_queued_user_does_not_delay_others(self):
+        processor = PerUserUpdateProcessor(4, max_pending_updates=64)
+        started = time.monotonic()
+        finished = {}
+
+        async def work(key, seconds):
+            await asyncio.sleep(seconds)
+            finished[key] = time.monotonic() - started
+
+        # Очередь первого пользователя длиннее лимита одновременных обновлений
+        tasks = [
+            asyncio.create_task(processor.process_update(make_update(i, 1), work(('u1', i), 0.1)))
+            for i in range(8)
+        ]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(
+            processor.process_update(make_update(100, 2), work('u2', 0.2))
+        ))
+        await asyncio.gather(*tasks)
+
+        self.assertLess(finished['u2'], 0.35)
+        # Обновления одного пользователя по-прежнему идут по очереди
+        self.assertGreaterEqual(finished[('u1', 7)], 0.8)
+        self.assertEqual(processor.active_users, 0)
+
+    async def test_same_user_keeps_order(self):
+        processor = PerUserUpdateProcessor(4)
+        order = []
+
+        async def work(i):
+            await asyncio.sleep(0.01 * (5 - i))
+            order.append(i)
+
+        await asyncio.gather(*(
+            processor.process_update(make_update(i, 1), work(i)) for i in range(5)
+        ))
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
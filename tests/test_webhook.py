@@ -0,0 +1,28 @@
+import unittest
+
+from webhook import WebhookServer, is_loopback
+
+
+class WebhookSecretTest(unittest.TestCase):
+    def test_public_address_requires_secret(self):
+        with self.assertRaises(ValueError):
+            WebhookServer(None, host='0.0.0.0', secret_token='')
+
+    def test_loopback_without_secret_warns(self):
+        with self.assertLogs('webhook', level='WARNING'):
+            server = WebhookServer(None, host='127.0.0.1')
+        self.assertIsNone(server.secret_token)
+
+    def test_public_address_with_secret(self):
+        server = WebhookServer(None, host='0.0.0.0', secret_token='s3cret')
+        self.assertEqual(server.secret_token, 's3cret')
+
+    def test_is_loopback(self):
+        self.assertTrue(is_loopback('localhost'))
+        self.assertTrue(is_loopback('::1'))
+        self.assertFalse(is_loopback('0.0.0.0'))
+        self.assertFalse(is_loopback('bot.example.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class _UserQueue:
+    __slots__ = ('lock', 'waiting')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Сколько обновлений пользователя выполняется или ждёт очереди
+        self.waiting = 0
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с очередью на каждого пользователя.
+
+    Обновления разных пользователей выполняются одновременно (не больше
+    max_concurrent_updates), а обновления одного пользователя - строго по
+    очереди в порядке поступления, поэтому открытие ящика и продажа не
+    пересекаются у одного игрока. Место в общем лимите занимается только
+    после того, как подошла очередь пользователя: его следующие обновления
+    ждут, не отнимая места у остальных. Очередь удаляется, как только у
+    пользователя не остаётся обновлений, так что память растёт только с
+    числом пользователей, чьи обновления обрабатываются прямо сейчас.
+    """
+
+    def __init__(self, max_concurrent_updates, max_pending_updates=None):
+        self._limit = max_concurrent_updates
+        pending = max_pending_updates or max_concurrent_updates * 16
+        super().__init__(pending)
+        # Семафор базового класса ограничивает все принятые обновления,
+        # включая ждущие своей очереди. Базовый класс строит его по
+        # max_concurrent_updates (здесь - число выполняемых), поэтому заменяем
+        self._semaphore = asyncio.BoundedSemaphore(pending)
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # user_id -> _UserQueue
+        self._queues = {}
+
+    @property
+    def max_concurrent_updates(self):
+        return self._limit
+
+    @property
+    def active_users(self):
+        return len(self._queues)
+
+    @staticmethod
+    def _user_id(update):
+        if isinstance(update, Update) and update.effective_user is not None:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        user_id = self._user_id(update)
+        if user_id is None:
+            async with self._running:
+                await coroutine
+            return
+
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = _UserQueue()
+        queue.waiting += 1
+        try:
+            # asyncio.Lock пропускает ждущих в порядке очереди
+            async with queue.lock:
+                async with self._running:
+                    await coroutine
+        finally:
+            queue.waiting -= 1
+            if not queue.waiting:
+                del self._queues[user_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,195 @@
+import hmac
+import json
+import asyncio
+import logging
+import ipaddress
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    429: 'Too Many Requests',
+    503: 'Service Unavailable',
+}
+
+
+def is_loopback(host):
+    """Адрес доступен только с этой машины"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WebhookServer:
+    """Приём обновлений от Telegram по HTTP (webhook).
+
+    Сервер только разбирает запрос, проверяет секретный токен и кладёт
+    обновление в ограниченную очередь, сразу отвечая 200. Обработкой
+    занимаются workers задач; если очередь заполнена, сервер отвечает 429,
+    и Telegram повторит доставку позже, а при остановке - 503. Без
+    секретного токена любой может прислать поддельное обновление, поэтому
+    так сервер запускается только на локальном адресе.
+    """
+
+    def __init__(self, application, host='0.0.0.0', port=8443, path='/telegram',
+                 secret_token=None, queue_size=1000, workers=64,
+                 max_body_size=1 << 20, idle_timeout=75, metrics=None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token or None
+        if self.secret_token is None:
+            if not is_loopback(host):
+                raise ValueError(f"Webhook на {host} без секретного токена: задайте WEBHOOK_SECRET")
+            logger.warning("WEBHOOK_SECRET не задан - запросы к webhook не проверяются")
+        self.workers = workers
+        self.max_body_size = max_body_size
+        self.idle_timeout = idle_timeout
+        self.metrics = metrics
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._server = None
+        self._tasks = []
+        self._connections = set()
+        self._accepting = False
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f'webhook-worker-{i}')
+            for i in range(self.workers)
+        ]
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self._accepting = True
+        logger.info(f"Webhook слушает http://{self.host}:{self.port}{self.path}")
+
+    async def stop(self, drain_timeout=10):
+        """Перестать принимать обновления и дообработать очередь"""
+        self._accepting = False
+        if self._server is not None:
+            self._server.close()
+            # Простаивающие keep-alive соединения иначе держали бы остановку
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дообработано обновлений: {self.queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        app = self.application
+        while True:
+            update = await self.queue.get()
+            try:
+                # Через update_processor, как и при run_polling
+                await app.update_processor.process_update(update, app.process_update(update))
+            except Exception:
+                logger.exception("Ошибка обработки обновления из webhook")
+            finally:
+                self.queue.task_done()
+                if self.metrics is not None:
+                    self.metrics.webhook_queue.set(self.queue.qsize())
+
+    def _enqueue(self, body):
+        """Разобрать тело запроса и поставить обновление в очередь; вернуть код ответа"""
+        if not self._accepting:
+            return 503
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception:
+            logger.warning("Webhook: не удалось разобрать обновление")
+            return 400
+        if update is None:
+            return 400
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            if self.metrics is not None:
+                self.metrics.webhook_rejected.inc()
+            return 429
+        if self.metrics is not None:
+            self.metrics.webhook_queue.set(self.queue.qsize())
+        return 200
+
+    def _check_secret(self, headers):
+        if self.secret_token is None:
+            return True
+        received = headers.get(SECRET_HEADER, '')
+        return hmac.compare_digest(received.encode(), self.secret_token.encode())
+
+    async def _read_request(self, reader):
+        """Прочитать один HTTP-запрос: (метод, путь, заголовки, тело) или None"""
+        request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        if not request_line:
+            return None
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise ValueError("неверная строка запроса")
+        method, target, _ = parts
+
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body_size:
+            return method, target, headers, None
+        body = await asyncio.wait_for(reader.readexactly(length), self.idle_timeout) if length else b''
+        return method, target, headers, body
+
+    async def _handle_connection(self, reader, writer):
+        # Telegram держит соединения открытыми (keep-alive) и шлёт по ним запросы подряд
+        self._connections.add(writer)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+
+                if target.split('?', 1)[0] != self.path:
+                    status = 404
+                elif method != 'POST':
+                    status = 405
+                elif not self._check_secret(headers):
+                    status = 403
+                elif body is None:
+                    status = 413
+                else:
+                    status = self._enqueue(body)
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and body is not None
+                writer.write(
+                    f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                    f'Content-Length: 0\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1')
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()